@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compares the row-wise DataFrame.apply version of get_detailed_transactions against
+the vectorized transactions_to_dataframe on synthetic Mint JSON transactions.
+
+usage: python benchmarks/bench_detailed_transactions.py [rows ...]
+"""
+
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from lib.localmintapi import json_date_to_datetime, reverse_credit_amount, transactions_to_dataframe
+
+DEFAULT_ROWS = [100000, 1000000]
+
+def synthetic_transactions(rows, seed=0):
+    rnd = random.Random(seed)
+    today = date.today()
+    txns = []
+    for i in range(rows):
+        day = today - timedelta(days=i * 3650 // rows)
+        if day.year == today.year:
+            odate = day.strftime('%b %d')
+        else:
+            odate = day.strftime('%m/%d/%y')
+        txns.append({
+            'id': i,
+            'odate': odate,
+            'amount': '${:,.2f}'.format(rnd.uniform(1, 5000)),
+            'isDebit': rnd.random() < 0.8,
+            'isPending': rnd.random() < 0.01,
+        })
+    return txns
+
+def legacy_transactions_to_dataframe(txns, remove_pending=True):
+    df = pd.DataFrame(txns)
+    df['odate'] = df['odate'].apply(json_date_to_datetime)
+    if remove_pending:
+        df = df[~df.isPending]
+        df.reset_index(drop=True, inplace=True)
+    df.amount = df.apply(reverse_credit_amount, axis=1)
+    return df
+
+def best_of(func, txns, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        df = func(txns)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS
+    print("%10s %12s %12s %9s" % ('rows', 'apply (s)', 'vector (s)', 'speedup'))
+    for rows in sizes:
+        txns = synthetic_transactions(rows)
+        repeat = 3 if rows <= 100000 else 1
+        legacy_time, legacy_df = best_of(legacy_transactions_to_dataframe, txns, repeat)
+        vector_time, vector_df = best_of(transactions_to_dataframe, txns, repeat)
+        pd.testing.assert_series_equal(legacy_df['amount'], vector_df['amount'], check_names=False)
+        assert (legacy_df['odate'].values == vector_df['odate'].values).all()
+        print("%10d %12.3f %12.3f %8.1fx" % (rows, legacy_time, vector_time, legacy_time / vector_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Cold-start import cost of each fintracker subcommand, measured with `python -X importtime`
+in a fresh interpreter per run. Imports what fintracker.COMMAND_IMPORTS lists for the command,
+which is what main() preloads before dispatching to it.
+
+usage: python benchmarks/bench_importtime.py [command ...] [--repeat N] [--top N]
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from fintracker import COMMAND_IMPORTS
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def importtime(command):
+    """Returns (wall seconds, {module: (self us, cumulative us, depth)}, error or None)"""
+    code = 'import fintracker; fintracker.preload(%r)' % command
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    wall = time.time() - start
+    modules = {}
+    errors = []
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+        elif not line.startswith('import time:'):
+            errors.append(line)
+    error = errors[-1] if process.returncode else None
+    return wall, modules, error
+
+def main():
+    cmdline = argparse.ArgumentParser()
+    cmdline.add_argument('commands', nargs='*', default=sorted(COMMAND_IMPORTS))
+    cmdline.add_argument('--repeat', type=int, default=3, help='runs per command, the fastest is reported')
+    cmdline.add_argument('--top', type=int, default=5, help='heaviest third party imports listed per command')
+    options = cmdline.parse_args()
+
+    # warm the OS file cache and the .pyc files so every command is measured the same way
+    importtime(options.commands[0])
+
+    print("%-14s %10s %12s  %s" % ('command', 'wall (ms)', 'imports (ms)', 'heaviest top-level imports'))
+    for command in options.commands:
+        runs = [importtime(command) for _ in range(options.repeat)]
+        wall, modules, error = min(runs, key=lambda run: run[0])
+        if error:
+            print("%-14s %10s %12s  failed: %s" % (command, '-', '-', error))
+            continue
+        top_level = dict((name, stats) for name, stats in modules.items() if stats[2] == 0)
+        total_ms = sum(stats[1] for stats in top_level.values()) / 1000.0
+        heaviest = sorted(top_level.items(), key=lambda item: item[1][1], reverse=True)[:options.top]
+        print("%-14s %10.0f %12.0f  %s" % (command, wall * 1000, total_ms,
+                                          ', '.join('%s %.0fms' % (name, stats[1] / 1000.0) for name, stats in heaviest)))
+
+if __name__ == '__main__':
+    main()
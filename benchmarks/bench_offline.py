@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of the real Mint, RobinhoodClient and update_*_sheet code against the local
+stand-ins (benchmarks/standin.py for Mint/Robinhood, lib.fakegoogle.FakeSheetsService for Sheets).
+Nothing touches the network or the real cache dir.
+
+For each scenario it reports latency (mean/min/max over --repeat runs), throughput in items per
+second (accounts, transactions or cells, whatever the scenario produces), HTTP requests per run,
+and the tracemalloc peak of one extra traced run. The stand-in runs in a child process, so its
+memory is not counted.
+
+The accounts scenario waits for the stand-in's refresh, which finishes the last institution
+--refresh-seconds after it starts, so its latency is dominated by that.
+
+usage: python benchmarks/bench_offline.py [scenario ...] [--accounts N] [--transactions N]
+                                          [--latency SECONDS] [--refresh-seconds SECONDS] [--repeat N]
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standin import StandinServer, standin_mint
+from lib.expenses import ExpenseMatrix
+from lib.fakegoogle import FakeSheetsService
+from lib.googleapi import SheetsWriter, update_finances_sheet, update_expenses_sheet
+from lib.localmintapi import Mint, CATEGORY_INDEX_TTL
+from lib.pipeline import collect_mint_findata
+from lib.robinhoodapi import RobinhoodClient
+
+SHEET_ID = 'standin-sheet'
+FINANCES_HISTORY_ROWS = 1000
+FINANCES_SHEET_ACCOUNTS = 9  # account cells in googleapi.write_finances_row
+
+class StandinMint(Mint):
+    """Keeps the category index in the benchmark's temp dir instead of cache/, and polls the
+    refresh at stand-in speed rather than at real bank speed"""
+    cache_dir = None
+    refresh_poll_delay = 0.05
+    refresh_poll_max_delay = 0.2
+
+    def get_category_index(self, path=None, ttl=CATEGORY_INDEX_TTL):
+        return Mint.get_category_index(self, os.path.join(self.cache_dir, 'categories.json'), ttl)
+
+class Bench(object):
+
+    def __init__(self, server, cache_dir):
+        self.server = server
+        self.cache_dir = cache_dir
+        StandinMint.cache_dir = cache_dir
+        self.mint = standin_mint(server.url, StandinMint)
+        self.robinhood = RobinhoodClient('standin', 'standin', api_root=server.url)
+        self.findata = None
+        self.detailed = None
+        self.sheet_cols = None
+
+    def fresh_writer(self, sheets):
+        """A SheetsWriter with no remembered state, so every run does the full read + write"""
+        run_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        return SheetsWriter(sheets, SHEET_ID, os.path.join(run_dir, 'state.json'), os.path.join(run_dir, 'snapshot.json'))
+
+    def finances_sheet(self):
+        sheets = FakeSheetsService()
+        grid = sheets.tab(SHEET_ID, 'Finances')
+        grid.append(['Date'] + self.sheet_cols)
+        start = date.today() - timedelta(days=FINANCES_HISTORY_ROWS + 1)
+        for i in range(FINANCES_HISTORY_ROWS):
+            grid.append([(start + timedelta(days=i)).strftime('%-m/%-d/%Y')] + [1.0] * 17)
+        return sheets
+
+    def scenarios(self):
+        return [
+            ('accounts', self.accounts),
+            ('refresh', self.refresh),
+            ('budgets', self.budgets),
+            ('transactions_json', self.transactions_json),
+            ('transactions_json_serial', self.transactions_json_serial),
+            ('transaction_pages', self.transaction_pages),
+            ('detailed_transactions', self.detailed_transactions),
+            ('transactions_csv', self.transactions_csv),
+            ('transactions_json_dedupe', self.transactions_json_dedupe),
+            ('transactions_csv_dedupe', self.transactions_csv_dedupe),
+            ('robinhood_cold', self.robinhood_cold),
+            ('robinhood_warm', self.robinhood_warm),
+            ('robinhood_snapshot', self.robinhood_snapshot),
+            ('finances_sheet', self.update_finances),
+            ('expenses_sheet', self.update_expenses),
+        ]
+
+    # each scenario returns how many items it produced
+
+    def accounts(self):
+        self.findata = collect_mint_findata(self.mint, {})
+        return len(self.findata)
+
+    def refresh(self):
+        self.mint.initiate_account_refresh()
+        return 1
+
+    def budgets(self):
+        budgets = self.mint.get_budgets()
+        return len(budgets['income']) + len(budgets['spend'])
+
+    def transactions_json(self):
+        return len(self.mint.get_transactions_json())
+
+    def transactions_json_serial(self):
+        """The same pull one page request at a time, for comparison"""
+        txns = []
+        for page in self.mint.iter_transaction_pages(in_flight=1):
+            txns.extend(page)
+        return len(txns)
+
+    def transaction_pages(self):
+        """Streams the pages without keeping them, as a caller that processes each one would"""
+        return sum(len(page) for page in self.mint.iter_transaction_pages())
+
+    def detailed_transactions(self):
+        self.detailed = self.mint.get_detailed_transactions()
+        return len(self.detailed)
+
+    def transactions_csv(self):
+        return len(self.mint.get_transactions())
+
+    def transactions_json_dedupe(self):
+        return len(self.mint.get_transactions_json(skip_duplicates=True))
+
+    def transactions_csv_dedupe(self):
+        return len(self.mint.get_transactions(skip_duplicates=True))
+
+    def robinhood_cold(self):
+        client = RobinhoodClient('standin', 'standin', api_root=self.server.url)
+        client.portfolio_value()
+        client.close()
+        return 1
+
+    def robinhood_warm(self):
+        self.robinhood.portfolio_value()
+        return 1
+
+    def robinhood_snapshot(self):
+        return len(self.robinhood.snapshot()['positions'])
+
+    def update_finances(self):
+        if self.findata is None:
+            self.accounts()
+        # the Finances row always has FINANCES_SHEET_ACCOUNTS account cells, pad when there are fewer accounts
+        findata = dict(self.findata)
+        for i in range(FINANCES_SHEET_ACCOUNTS - len(findata)):
+            findata['Standin: Unused %d' % i] = 0.0
+        self.sheet_cols = sorted(findata)[:FINANCES_SHEET_ACCOUNTS]
+        sheets = self.finances_sheet()
+        update_finances_sheet(SHEET_ID, findata, writer=self.fresh_writer(sheets), sheet_cols=self.sheet_cols)
+        return len(self.sheet_cols)
+
+    def update_expenses(self):
+        if self.detailed is None:
+            self.detailed_transactions()
+        matrix = ExpenseMatrix.from_transactions(self.detailed)
+        update_expenses_sheet(SHEET_ID, None, matrix, writer=self.fresh_writer(FakeSheetsService()))
+        return matrix.matrix.size
+
+def quiet(func):
+    """Runs func with stdout silenced, the library code prints progress as it goes"""
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def measure(bench, func, repeat):
+    func_quiet = lambda: quiet(func)
+    func_quiet()  # warm up: connections, category index, imports
+    times = []
+    requests_before = bench.server.request_count()
+    for _ in range(repeat):
+        start = time.time()
+        items = func_quiet()
+        times.append(time.time() - start)
+    requests = (bench.server.request_count() - requests_before) / float(repeat)
+    tracemalloc.start()
+    func_quiet()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, items, requests, peak
+
+def main():
+    cmdline = argparse.ArgumentParser()
+    cmdline.add_argument('scenarios', nargs='*', help='scenarios to run (default: all)')
+    cmdline.add_argument('--accounts', type=int, default=20)
+    cmdline.add_argument('--transactions', type=int, default=20000)
+    cmdline.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in sleeps before each response')
+    cmdline.add_argument('--refresh-seconds', type=float, default=0.5, help='how long the stand-in takes to refresh every institution')
+    cmdline.add_argument('--repeat', type=int, default=3)
+    options = cmdline.parse_args()
+
+    server = StandinServer(accounts=options.accounts, transactions=options.transactions, latency=options.latency,
+                           refresh_seconds=options.refresh_seconds).start()
+    cache_dir = tempfile.mkdtemp(prefix='fintracker-bench-')
+    try:
+        bench = Bench(server, cache_dir)
+        scenarios = bench.scenarios()
+        if options.scenarios:
+            unknown = set(options.scenarios) - set(name for name, _ in scenarios)
+            if unknown:
+                sys.exit('unknown scenario(s): %s' % ', '.join(sorted(unknown)))
+            scenarios = [(name, func) for name, func in scenarios if name in options.scenarios]
+
+        print("%d accounts, %d transactions, %.0fms latency, best of %d" % (
+            options.accounts, options.transactions, options.latency * 1000, options.repeat))
+        print("%-24s %9s %9s %9s %12s %9s %9s" % ('scenario', 'mean ms', 'min ms', 'max ms', 'items/s', 'requests', 'peak MB'))
+        for name, func in scenarios:
+            times, items, requests, peak = measure(bench, func, options.repeat)
+            mean = sum(times) / len(times)
+            print("%-24s %9.1f %9.1f %9.1f %12.0f %9.1f %9.1f" % (
+                name, mean * 1000, min(times) * 1000, max(times) * 1000, items / mean, requests, peak / 1e6))
+    finally:
+        server.stop()
+        shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+Local stand-in for the Mint and Robinhood HTTP APIs, serving synthetic accounts and transaction
+histories of any size, so the real Mint and RobinhoodClient code can be run and measured offline.
+
+    server = StandinServer(accounts=20, transactions=50000, latency=0.05)
+    server.start()                          # runs in a child process, so it stays out of memory numbers
+    mint = standin_mint(server.url)
+    mint.get_detailed_transactions()
+    RobinhoodClient('user', 'pass', api_root=server.url).snapshot()
+    server.stop()
+
+Mint routes: bundledServiceController.xevent (getAccountsSorted, getCategoryTreeDto2, setUserProperty),
+getJsonData.xevent (paged by offset, newest first), transactionDownload.event (CSV), getBudget.xevent,
+userStatus.xevent and refreshFILogins.xevent, after which each institution's accounts get a new
+fiLastUpdated/lastUpdated one after another over `refresh_seconds`. Robinhood routes: oauth2/token/,
+portfolios/, positions/ and accounts/. `latency` seconds are slept before every response to stand in for the network.
+"""
+
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python 3
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer  # Python 2
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.localmintapi import Mint, make_session
+
+PAGE_SIZE = 100  # transactions per getJsonData.xevent page, as Mint does
+CSV_BLOCK = 64 * 1024
+CSV_HEADER = '"Date","Description","Original Description","Amount","Transaction Type","Category","Account Name","Labels","Notes"\n'
+ACCOUNT_TYPES = ['bank', 'bank', 'credit', 'investment', 'loan']
+INSTITUTIONS = ['Chase', 'Ally', 'Amex', 'Vanguard', 'Navient', 'Wells Fargo', 'Discover']
+CATEGORY_TREE = {
+    'Food & Dining': ['Groceries', 'Restaurants', 'Coffee Shops'],
+    'Auto & Transport': ['Gas & Fuel', 'Parking'],
+    'Bills & Utilities': ['Utilities', 'Internet'],
+    'Home': ['Mortgage & Rent'],
+    'Income': ['Paycheck'],
+    'Shopping': ['Clothing', 'Electronics & Software'],
+    'Transfer': ['Credit Card Payment'],
+    'Uncategorized': [],
+}
+STANDIN_TOKEN = 'standin-token'
+
+def json_odate(day, today):
+    """Mint's JSON date format: 'Oct 18' for this year, '10/18/17' before that"""
+    if day.year == today.year:
+        return day.strftime('%b %d')
+    return day.strftime('%m/%d/%y')
+
+def js_timestamp(dt):
+    return int(time.mktime(dt.timetuple()) * 1000)
+
+class StandinData(object):
+    """Synthetic Mint accounts, categories, budgets and a transaction history, deterministic per seed"""
+
+    def __init__(self, accounts=20, transactions=10000, years=5, seed=0, pending=20, refresh_seconds=1.0):
+        rnd = random.Random(seed)
+        self.refresh_seconds = refresh_seconds
+        self.refreshing = {}  # account id -> when its institution finishes the refresh in progress
+        today = date.today()
+        now = datetime.now()
+
+        self.categories = []
+        category_ids = []
+        next_id = 1
+        for parent, children in sorted(CATEGORY_TREE.items()):
+            parent_id = next_id
+            next_id += 1
+            node = {'id': parent_id, 'name': parent, 'children': []}
+            for child in children:
+                node['children'].append({'id': next_id, 'name': child})
+                category_ids.append((next_id, child))
+                next_id += 1
+            if not children:
+                category_ids.append((parent_id, parent))
+            self.categories.append(node)
+
+        self.accounts = []
+        for i in range(accounts):
+            account_type = ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)]
+            balance = round(rnd.uniform(100, 50000), 2)
+            self.accounts.append({
+                'id': 1000 + i,
+                'accountId': 1000 + i,
+                'accountName': '%s %d' % (account_type.title(), i),
+                'fiName': INSTITUTIONS[i % len(INSTITUTIONS)],
+                'accountType': account_type,
+                'currentBalance': balance,
+                'value': -balance if account_type in ('credit', 'loan') else balance,
+                'isActive': True,
+                'addAccountDate': js_timestamp(now - timedelta(days=1000)),
+                'fiLastUpdated': js_timestamp(now - timedelta(hours=rnd.randint(1, 48))),
+                'lastUpdated': js_timestamp(now - timedelta(hours=rnd.randint(1, 48))),
+            })
+
+        days = years * 365
+        self.transactions = []
+        for i in range(transactions):
+            day = today - timedelta(days=i * days // max(transactions, 1))
+            category_id, category = rnd.choice(category_ids)
+            account = self.accounts[rnd.randrange(accounts)] if accounts else {'accountName': 'Checking', 'fiName': 'Bank'}
+            merchant = 'Merchant %d' % rnd.randint(1, 2000)
+            amount = round(rnd.uniform(1, 500 if category != 'Paycheck' else 5000), 2)
+            self.transactions.append({
+                'id': 900000000 - i,
+                'odate': json_odate(day, today),
+                'date': json_odate(day, today),
+                'amount': '${:,.2f}'.format(amount),
+                'isDebit': category != 'Paycheck',
+                'isPending': i < pending,
+                'isDuplicate': False,
+                'category': category,
+                'categoryId': category_id,
+                'merchant': merchant,
+                'omerchant': merchant.upper() + ' #1234',
+                'account': account['accountName'],
+                'fi': account['fiName'],
+                'day': day.strftime('%m/%d/%Y'),  # only used to render the CSV
+            })
+
+        self.budgets = {
+            'income': {'0': {'bu': [{'cat': cid, 'amt': 5000.0, 'bgt': 5000.0} for cid, name in category_ids if name == 'Paycheck']}},
+            'spending': {'0': {'bu': [{'cat': cid, 'amt': round(rnd.uniform(0, 800), 2), 'bgt': 500.0}
+                                      for cid, name in category_ids if name != 'Paycheck']}},
+        }
+        self.csv = self.render_csv()
+
+    def render_csv(self):
+        lines = [CSV_HEADER]
+        for t in self.transactions:
+            lines.append('"%s","%s","%s","%s","%s","%s","%s","",""\n' % (
+                t['day'], t['merchant'], t['omerchant'], t['amount'].strip('$').replace(',', ''),
+                'debit' if t['isDebit'] else 'credit', t['category'], t['account']))
+        return ''.join(lines).encode('utf-8')
+
+    def transactions_page(self, offset):
+        page = self.transactions[offset:offset + PAGE_SIZE]
+        return [dict((k, v) for k, v in t.items() if k != 'day') for t in page]
+
+    def start_refresh(self):
+        """Institutions finish one after another over refresh_seconds, in INSTITUTIONS order"""
+        now = time.time()
+        for account in self.accounts:
+            rank = INSTITUTIONS.index(account['fiName']) + 1
+            self.refreshing[account['id']] = now + self.refresh_seconds * rank / len(INSTITUTIONS)
+
+    def finish_refreshes(self):
+        now = time.time()
+        for account in self.accounts:
+            finished_at = self.refreshing.get(account['id'])
+            if finished_at is not None and finished_at <= now:
+                account['fiLastUpdated'] = account['lastUpdated'] = int(finished_at * 1000)
+                self.refreshing.pop(account['id'], None)
+
+    def bundled_response(self, tasks):
+        response = {}
+        for task in tasks:
+            if task['task'] == 'getAccountsSorted':
+                self.finish_refreshes()
+                value = self.accounts
+            elif task['task'] == 'getCategoryTreeDto2':
+                value = {'allCategories': self.categories}
+            else:
+                value = True
+            response[task['id']] = {'response': value}
+        return {'response': response}
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so pooled sessions reuse their connections
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type='application/json', status=200):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), CSV_BLOCK):
+            self.wfile.write(body[i:i + CSV_BLOCK])
+
+    def read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        return dict((k, v[0]) for k, v in parse_qs(body).items())
+
+    def route(self, method):
+        time.sleep(self.server.latency)
+        with self.server.requests.get_lock():
+            self.server.requests.value += 1
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        data = self.server.data
+        path = url.path
+
+        if path == '/bundledServiceController.xevent' and method == 'POST':
+            return self.send_body(data.bundled_response(json.loads(self.read_form()['input'])))
+        if path == '/getJsonData.xevent':
+            return self.send_body({'set': [{'data': data.transactions_page(int(query.get('offset', 0)))}]})
+        if path == '/transactionDownload.event':
+            return self.send_body(data.csv, content_type='text/csv')
+        if path == '/getBudget.xevent':
+            return self.send_body({'data': data.budgets})
+        if path == '/userStatus.xevent':
+            return self.send_body({'isLoggedIn': True})
+        if path == '/refreshFILogins.xevent':
+            self.read_form()
+            data.start_refresh()
+            return self.send_body({})
+
+        if path == '/oauth2/token/' and method == 'POST':
+            form = self.read_form()
+            if form.get('grant_type') == 'password' and form.get('password') != 'standin':
+                return self.send_body({'detail': 'Unable to log in with provided credentials.'}, status=400)
+            return self.send_body({'access_token': STANDIN_TOKEN, 'refresh_token': 'standin-refresh', 'expires_in': 86400})
+        if path in ('/portfolios/', '/positions/', '/accounts/'):
+            if self.headers.get('Authorization') != 'Bearer %s' % STANDIN_TOKEN:
+                return self.send_body({'detail': 'Invalid token.'}, status=401)
+            if path == '/portfolios/':
+                equity = '%.2f' % sum(a['currentBalance'] for a in data.accounts if a['accountType'] == 'investment')
+                return self.send_body({'results': [{'equity': equity, 'extended_hours_equity': None}]})
+            if path == '/positions/':
+                return self.send_body({'results': [{'quantity': '10.0000', 'average_buy_price': '100.00'}] * 25})
+            return self.send_body({'results': [{'account_number': 'STANDIN', 'buying_power': '100.00'}]})
+
+        self.send_body({'error': 'no stand-in for %s %s' % (method, path)}, status=404)
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+class ThreadingStandinServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def serve(data_kwargs, latency, requests, conn):
+    server = ThreadingStandinServer(('127.0.0.1', 0), StandinHandler)
+    server.data = StandinData(**data_kwargs)
+    server.latency = latency
+    server.requests = requests
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+class StandinServer(object):
+    """Runs the stand-in in a child process; url is set once start() returns"""
+
+    def __init__(self, accounts=20, transactions=10000, years=5, seed=0, latency=0.0, refresh_seconds=1.0):
+        self.data_kwargs = {'accounts': accounts, 'transactions': transactions, 'years': years, 'seed': seed,
+                            'refresh_seconds': refresh_seconds}
+        self.latency = latency
+        self.requests = multiprocessing.Value('i', 0)
+        self.process = None
+        self.url = None
+
+    def start(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(self.data_kwargs, self.latency, self.requests, child_conn))
+        self.process.daemon = True
+        self.process.start()
+        self.url = 'http://127.0.0.1:%d' % parent_conn.recv()
+        return self
+
+    def request_count(self):
+        return self.requests.value
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+def standin_mint(url, mint_class=Mint):
+    """A Mint already 'logged in' to the stand-in, talking to it over a pooled requests session"""
+    mint = mint_class(root_url=url)
+    mint.session = make_session([])
+    mint.token = STANDIN_TOKEN
+    return mint
@@ -1,31 +1,51 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
-import atexit
-from datetime import date, datetime, timedelta
-import random
+import importlib
 import sys
 
-from lib.googleapi import update_finances_sheet
-from lib.robinhoodapi import get_robinhood_portfolio_value
-from lib.localmintapi import Mint, get_accounts, make_accounts_presentable, initiate_account_refresh
 from const.CONSTANTS import *
 from pprint import pprint
 
 """
 TODO send_gmail WHEN SCRIPT ENCOUNTERS FAILURE/BAD VALUE FOR ACCOUNTS
+
+Every subcommand imports only the modules it needs, so e.g. `fintracker.py robinhood` never loads
+pandas, selenium or the Google client. Running with no subcommand (or with just email/password, as
+cron does) is the same as `run`:
+
+    run [email] [password]            full snapshot: Mint + Robinhood -> Finances sheet
+    accounts [email] [password]       print the Mint account balances
+    robinhood                         print the Robinhood portfolio value
+    push-sheet                        write the latest locally recorded snapshot to the Finances sheet
+    transactions [email] [password]   sync Mint transactions into the local store
+    daemon [email] [password]         stay running and run jobs on a schedule
+    batch FILE                        run every profile in a profiles file
+    trigger COMMAND                   send a command to a running daemon
 """
 
-def main():
+# what each subcommand imports, used by preload() and benchmarks/bench_importtime.py
+COMMAND_IMPORTS = {
+    'run': ['lib.pipeline', 'lib.localmintapi', 'lib.sessioncache', 'lib.googleapi', 'lib.robinhoodapi'],
+    'accounts': ['lib.pipeline', 'lib.localmintapi', 'lib.sessioncache'],
+    'robinhood': ['lib.robinhoodapi'],
+    'push-sheet': ['lib.pipeline', 'lib.googleapi', 'lib.balancestore'],
+    'transactions': ['lib.pipeline', 'lib.localmintapi', 'lib.sessioncache', 'lib.transactionstore'],
+    'daemon': ['lib.daemon', 'lib.localmintapi', 'lib.sessioncache', 'lib.googleapi', 'lib.robinhoodapi'],
+    'batch': ['lib.profiles'],
+    'trigger': ['lib.daemon'],
+}
+
+# run, daemon and batch reset and export metrics themselves for every run, job or profile, and trigger
+# only talks to the daemon; every other subcommand's metrics are exported by main() when it exits
+METERED_COMMANDS = ('accounts', 'robinhood', 'push-sheet', 'transactions')
+
+def preload(command):
+    for module in COMMAND_IMPORTS[command]:
+        importlib.import_module(module)
+
+def get_mint_credentials(options):
     import getpass
-    import argparse
-
-    # Parse command-line arguments {{{
-    cmdline = argparse.ArgumentParser()
-    cmdline.add_argument('email', nargs='?', default=None, help='The e-mail address for your Mint.com account')
-    cmdline.add_argument('password', nargs='?', default=None, help='The password for your Mint.com account')
-
-    options = cmdline.parse_args()
 
     try:  # python 2.x
         from __builtin__ import raw_input as input
@@ -52,32 +72,163 @@ def main():
         else:
             password = getpass.getpass("Mint password: ")
 
+    return email, password
+
+def run_command(options):
+    from lib.pipeline import run_finances_pipeline
+    email, password = get_mint_credentials(options)
+    run_finances_pipeline(email, password, ROBINHOOD_USER, ROBINHOOD_PASS, MASTER_SHEET_ID)
 
-    print("Creating mint object")
-    mint = Mint.create(email, password)
-    print("Refreshing mint account details")
-    mint.initiate_account_refresh()
-    atexit.register(mint.close)  # Ensure everything is torn down.
+def print_account(fintype, value, refreshed):
+    print("  %-40s %12.2f%s" % (fintype, value, '' if refreshed else '  (stale)'))
 
+def accounts_command(options):
+    from lib.pipeline import login_mint, collect_mint_findata, print_timings
+    email, password = get_mint_credentials(options)
+    timings = {}
+    mint = login_mint(email, password)
+    try:
+        pprint(collect_mint_findata(mint, timings, on_account=print_account))
+    finally:
+        mint.close()
+    print_timings(timings)
+
+def robinhood_command(options):
+    from lib.robinhoodapi import get_robinhood_portfolio_value
+    print(get_robinhood_portfolio_value(ROBINHOOD_USER, ROBINHOOD_PASS))
+
+def push_sheet_command(options):
+    from lib.balancestore import BalanceStore
+    from lib.pipeline import prepare_finances_sheet, write_finances_sheet
+    store = BalanceStore()
+    try:
+        ts, findata = store.latest()
+    finally:
+        store.close()
+    if not findata:
+        sys.exit("No recorded snapshot to push, run fintracker.py first")
+    pprint(findata)
+    writer, tail = prepare_finances_sheet(MASTER_SHEET_ID)
+    write_finances_sheet(writer, findata, tail)
+
+def transactions_command(options):
+    from lib.pipeline import login_mint
+    from lib.transactionstore import TransactionStore
+    email, password = get_mint_credentials(options)
+    store = TransactionStore()
+    mint = login_mint(email, password)
+    try:
+        changed = mint.sync_transactions(store, include_investment=options.include_investment,
+                                         skip_duplicates=options.skip_duplicates)
+    finally:
+        mint.close()
+        store.close()
+    print("Synced %d new or changed transactions" % len(changed))
+
+def daemon_command(options):
+    from lib.daemon import FintrackerDaemon, DaemonAlreadyRunning, CONTROL_SOCKET_PATH
+    email, password = get_mint_credentials(options)
+    daemon = FintrackerDaemon(email, password, ROBINHOOD_USER, ROBINHOOD_PASS, MASTER_SHEET_ID,
+                              accounts_interval=options.accounts_interval * 60,
+                              transactions_interval=options.transactions_interval * 60,
+                              control_socket=options.control_socket or CONTROL_SOCKET_PATH)
     try:
-        print("Getting accounts data")
-        data = make_accounts_presentable(mint.get_accounts(
-            get_detail=False)
-        )
-    except Exception as e:
-        print("get_accounts encountered exception: %s" % e)
-        data = None
-
-    # output the data
-    findata = {}
-    for dat in data:
-        fintype = "%s: %s" % (dat['fiName'], dat['accountName'])
-        findata[fintype] = abs(dat['value'])
-    print("Retrieving robinhood portfolio")
-    findata[u'Robinhood'] = get_robinhood_portfolio_value(ROBINHOOD_USER, ROBINHOOD_PASS)
-
-    update_finances_sheet(MASTER_SHEET_ID, findata)
-    mint.close()
+        daemon.serve_forever()
+    except DaemonAlreadyRunning as e:
+        sys.exit("daemon already running (%s)" % e)
+
+def batch_command(options):
+    from lib.profiles import load_profiles, run_profiles, print_profile_summary
+    summaries = run_profiles(load_profiles(options.profiles), processes=options.processes, max_browsers=options.max_browsers)
+    print_profile_summary(summaries)
+    if not all(summary['ok'] for summary in summaries):
+        sys.exit(1)
+
+def trigger_command(options):
+    import errno
+    import socket
+    from lib.daemon import send_control_command, CONTROL_SOCKET_PATH
+    control_socket = options.control_socket or CONTROL_SOCKET_PATH
+    try:
+        reply = send_control_command(options.control_command, control_socket)
+    except socket.error as e:
+        # no socket file, or a stale one left behind by a daemon that was killed
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        sys.exit("daemon not running (nothing listening on %s)" % control_socket)
+    pprint(reply)
+
+COMMANDS = {
+    'run': run_command,
+    'accounts': accounts_command,
+    'robinhood': robinhood_command,
+    'push-sheet': push_sheet_command,
+    'transactions': transactions_command,
+    'daemon': daemon_command,
+    'batch': batch_command,
+    'trigger': trigger_command,
+}
+
+def run_metered(command, options):
+    """Runs a subcommand and exports its metrics as the fintracker_<command> run, whether or not it succeeded"""
+    from lib.metrics import metrics, set_run_name
+    set_run_name('fintracker_%s' % command.replace('-', '_'))
+    metrics.reset()
+    ok = False
+    try:
+        COMMANDS[command](options)
+        ok = True
+    finally:
+        metrics.export(ok=ok)
+
+def add_mint_arguments(parser):
+    parser.add_argument('email', nargs='?', default=None, help='The e-mail address for your Mint.com account')
+    parser.add_argument('password', nargs='?', default=None, help='The password for your Mint.com account')
+
+def main(argv=None):
+    import argparse
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'run')
+
+    # Parse command-line arguments {{{
+    cmdline = argparse.ArgumentParser()
+    commands = cmdline.add_subparsers()
+
+    add_mint_arguments(commands.add_parser('run', help='Snapshot Mint and Robinhood into the Finances sheet (default)'))
+    add_mint_arguments(commands.add_parser('accounts', help='Print the Mint account balances'))
+    commands.add_parser('robinhood', help='Print the Robinhood portfolio value')
+    commands.add_parser('push-sheet', help='Write the latest recorded snapshot to the Finances sheet')
+
+    transactions = commands.add_parser('transactions', help='Sync Mint transactions into the local store')
+    add_mint_arguments(transactions)
+    transactions.add_argument('--include-investment', action='store_true', help='Also sync investment transactions')
+    transactions.add_argument('--skip-duplicates', action='store_true', help='Leave out transactions that duplicate another one')
+
+    daemon = commands.add_parser('daemon', help='Stay running with a warm Mint session and run jobs on a schedule')
+    add_mint_arguments(daemon)
+    daemon.add_argument('--accounts-interval', type=float, default=240, help='Minutes between account snapshots')
+    daemon.add_argument('--transactions-interval', type=float, default=1440, help='Minutes between transaction syncs')
+    daemon.add_argument('--control-socket', default=None, help='Path of the daemon control socket')
+
+    batch = commands.add_parser('batch', help='Run every profile in a JSON profiles file')
+    batch.add_argument('profiles', metavar='FILE', help='JSON list of profiles')
+    batch.add_argument('--processes', type=int, default=None, help='Worker processes (default: one per profile)')
+    batch.add_argument('--max-browsers', type=int, default=2, help='Most Chrome instances running at once')
+
+    trigger = commands.add_parser('trigger', help='Send a command to a running daemon')
+    trigger.add_argument('control_command', metavar='COMMAND', help='e.g. "run accounts", "status", "stop"')
+    trigger.add_argument('--control-socket', default=None, help='Path of the daemon control socket')
+
+    options = cmdline.parse_args(argv)
+    command = argv[0]
+
+    preload(command)
+    if command in METERED_COMMANDS:
+        run_metered(command, options)
+    else:
+        COMMANDS[command](options)
 
     """ TO-DO: """
     # top-level exception catcher here to close mint no matter what and prevent buildup of zombie instances
@@ -9,15 +9,6 @@ command -v pip >/dev/null 2>&1 || { echo "pip is not installed, running `sudo ea
 #python -m virtualenv env
 #source env/bin/activate
 
-# CHECK HERE IF ROBINHOOD ALREADY EXISTS
-echo ">Cloning robinhood repo and installing it as pip module"
-git clone https://github.com/Jamonek/Robinhood.git
-cd Robinhood
-echo ">pip installing Robinhood"
-pip install --user .
-cd ..
-echo ">Removing Robinhood dir"
-rm -rf Robinhood
 echo ">pip installing dependencies"
 pip install --user httplib2 google-api-python-client oauth2client selenium selenium-requests
 
@@ -0,0 +1,52 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where locked() doesn't lock
+    fcntl = None
+
+"""
+Helpers for state files under cache/ that several processes may touch at once (batch profiles in
+their pool workers, the daemon next to a cron run): write_atomic never leaves a half written file
+for a reader to find, and locked() serializes a load-modify-save so no process loses another's update.
+
+    with locked(path):
+        state = load(path)
+        state[key] = value
+        write_atomic(path, json.dumps(state))
+"""
+
+replace = getattr(os, 'replace', os.rename)  # os.rename already replaces on POSIX under Python 2
+
+def ensure_parent_dir(path):
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.exists(dir_path):
+        try:
+            os.makedirs(dir_path)
+        except OSError:
+            if not os.path.isdir(dir_path):  # another process may have just made it
+                raise
+
+def write_atomic(path, data, perms=0o666):
+    """Writes data (str or bytes) to a temp file next to path and renames it over path"""
+    ensure_parent_dir(path)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, perms)
+    with os.fdopen(fd, 'wb') as tmpfile:
+        tmpfile.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+    replace(tmp_path, path)
+
+@contextmanager
+def locked(path):
+    """Holds an exclusive lock on path + '.lock' for the duration of the block"""
+    if fcntl is None:
+        yield
+        return
+    ensure_parent_dir(path)
+    with open(path + '.lock', 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
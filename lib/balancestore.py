@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import time
+
+from . import CACHE_DIR
+
+BALANCE_STORE_PATH = os.path.join(CACHE_DIR, 'balances.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    ts INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    account_type TEXT,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS balances_ts ON balances (ts);
+CREATE INDEX IF NOT EXISTS balances_account_ts ON balances (account, ts);
+"""
+
+class BalanceStore(object):
+    """Append-only local history of account balances, one row per account per snapshot.
+
+    Every pipeline run records its findata here, so reports can read history from disk instead of
+    pulling the whole Finances sheet back over the network:
+
+        store = BalanceStore()
+        store.balances(start='2018-01-01')          # snapshot x account DataFrame
+        store.resample('W')                         # last balance of each week
+        store.net_worth(rule='W')                   # signed with Mint.get_net_worth's rules
+
+    Values are kept as written to the sheet (positive); the account type recorded alongside them
+    decides the sign when computing net worth.
+    """
+
+    def __init__(self, path=BALANCE_STORE_PATH):
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, findata, account_types=None, timestamp=None):
+        """Appends one snapshot of {account: value}, returns its epoch timestamp"""
+        account_types = account_types or {}
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO balances (ts, account, account_type, value) VALUES (?, ?, ?, ?)',
+                [(timestamp, account, account_types.get(account), float(value))
+                 for account, value in findata.items() if value is not None])
+        return timestamp
+
+    def accounts(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT account FROM balances ORDER BY account')]
+
+    def account_types(self):
+        """{account: account type} as of each account's latest snapshot"""
+        return dict(self.conn.execute(
+            'SELECT account, account_type FROM balances b WHERE ts = '
+            '(SELECT MAX(ts) FROM balances WHERE account = b.account)'))
+
+    def latest(self):
+        """Returns (ts, {account: value}) of the newest snapshot, or (None, {}) when empty"""
+        ts = self.conn.execute('SELECT MAX(ts) FROM balances').fetchone()[0]
+        if ts is None:
+            return None, {}
+        return ts, dict(self.conn.execute('SELECT account, value FROM balances WHERE ts = ?', (ts,)))
+
+    def rows(self, start=None, end=None, accounts=None):
+        """Returns (ts, account, account_type, value) tuples in time order, start/end inclusive"""
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(to_epoch(start))
+        if end is not None:
+            clauses.append('ts <= ?')
+            params.append(to_epoch(end))
+        if accounts:
+            accounts = list(accounts)
+            clauses.append('account IN (%s)' % ','.join('?' * len(accounts)))
+            params.extend(accounts)
+        query = 'SELECT ts, account, account_type, value FROM balances'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        return self.conn.execute(query + ' ORDER BY ts, account', params).fetchall()
+
+    def frame(self, start=None, end=None, accounts=None):
+        """Long DataFrame of the matching rows, with ts as datetimes"""
+        from .localmintapi import assert_pd
+        np, pd = assert_pd()
+        df = pd.DataFrame(self.rows(start, end, accounts), columns=['ts', 'account', 'account_type', 'value'])
+        df['ts'] = pd.to_datetime(df['ts'], unit='s')
+        return df
+
+    def balances(self, start=None, end=None, accounts=None):
+        """snapshot time x account DataFrame of values, NaN where an account wasn't in a snapshot"""
+        df = self.frame(start, end, accounts)
+        return df.pivot_table(index='ts', columns='account', values='value', aggfunc='last')
+
+    def resample(self, rule, start=None, end=None, accounts=None):
+        """Last known balance of every account per period (pandas offset alias, e.g. 'D', 'W')"""
+        return self.balances(start, end, accounts).resample(rule).last().ffill()
+
+    def net_worth(self, start=None, end=None, rule=None):
+        """Series of net worth per snapshot, or per period when rule is given"""
+        from .localmintapi import INVERTED_ACCOUNT_TYPES
+        df = self.frame(start, end)
+        # same sign rule as signed_balance / Mint.get_net_worth, vectorized
+        df['value'] = df['value'].where(~df['account_type'].isin(list(INVERTED_ACCOUNT_TYPES)), -df['value'])
+        if rule is None:
+            return df.groupby('ts')['value'].sum().rename('net_worth')
+        signed = df.pivot_table(index='ts', columns='account', values='value', aggfunc='last')
+        return signed.resample(rule).last().ffill().sum(axis=1).rename('net_worth')
+
+def to_epoch(value):
+    """Accepts epoch seconds, datetimes/Timestamps or date strings, naive times are taken as UTC"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    from .localmintapi import assert_pd
+    np, pd = assert_pd()
+    return int(pd.Timestamp(value).timestamp())
@@ -0,0 +1,63 @@
+import json
+import os
+import time
+
+from . import CACHE_DIR
+from .atomicfile import write_atomic
+
+CATEGORY_INDEX_PATH = os.path.join(CACHE_DIR, 'categories.json')
+CATEGORY_INDEX_TTL = 7 * 24 * 60 * 60  # seconds, Mint's category tree almost never changes
+
+class CategoryIndex(object):
+    """Flat id -> {'id', 'name', 'parent_id'} view of Mint's category tree, so that
+    budget and transaction category ids resolve with a single dict lookup."""
+
+    def __init__(self, nodes, built_at=None):
+        self.nodes = nodes
+        self.built_at = built_at or time.time()
+
+    @classmethod
+    def from_categories(cls, categories):
+        """Builds the index from Mint.get_categories() output, where each top level
+        category may carry its subcategories in a 'children' list"""
+        nodes = {}
+        for category in categories.values():
+            nodes[category['id']] = {'id': category['id'], 'name': category['name'], 'parent_id': None}
+            for child in category.get('children') or []:
+                nodes[child['id']] = {'id': child['id'], 'name': child['name'], 'parent_id': category['id']}
+        return cls(nodes)
+
+    @classmethod
+    def load(cls, path=CATEGORY_INDEX_PATH, ttl=CATEGORY_INDEX_TTL):
+        """Returns the saved index, or None if there isn't one or it is older than ttl seconds"""
+        if not os.path.exists(path):
+            return None
+        with open(path) as indexfile:
+            saved = json.load(indexfile)
+        if time.time() - saved['built_at'] > ttl:
+            return None
+        # json turns the integer ids into strings
+        nodes = dict((int(cid), node) for cid, node in saved['nodes'].items())
+        return cls(nodes, built_at=saved['built_at'])
+
+    def save(self, path=CATEGORY_INDEX_PATH):
+        write_atomic(path, json.dumps({'built_at': self.built_at, 'nodes': self.nodes}))
+
+    def name(self, cid):
+        if cid == 0:
+            return 'Uncategorized'
+        node = self.nodes.get(cid)
+        return node['name'] if node else 'Unknown'
+
+    def parent(self, cid):
+        """Returns the parent category node, or None for top level/unknown ids"""
+        node = self.nodes.get(cid)
+        if not node or node['parent_id'] is None:
+            return None
+        return self.nodes.get(node['parent_id'])
+
+    def names(self):
+        """id -> name dict, e.g. for df['categoryId'].map(index.names())"""
+        names = dict((cid, node['name']) for cid, node in self.nodes.items())
+        names[0] = 'Uncategorized'
+        return names
@@ -0,0 +1,205 @@
+from __future__ import print_function
+import errno
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+try:
+    import socketserver  # Python 3
+    from queue import Queue, Empty
+except ImportError:
+    import SocketServer as socketserver  # Python 2
+    from Queue import Queue, Empty
+
+from . import CACHE_DIR
+from .metrics import metrics, set_run_name
+from .pipeline import login_mint, collect_mint_findata, prepare_finances_sheet, write_finances_sheet, record_written_balances, get_robinhood_value, print_timings, timed
+from .transactionstore import TransactionStore
+
+CONTROL_SOCKET_PATH = os.path.join(CACHE_DIR, 'fintracker.sock')
+ACCOUNTS_INTERVAL = 4 * 60 * 60  # seconds
+TRANSACTIONS_INTERVAL = 24 * 60 * 60  # seconds
+CONTROL_COMMANDS = ('run accounts', 'run transactions', 'status', 'stop')
+
+"""
+Long-running mode: one process keeps the authenticated Mint session, the Google service objects and the
+imports warm, and runs the account snapshot and transaction sync on a schedule instead of from cron.
+
+Jobs only ever run on the main loop's thread, one at a time. The control socket (a unix socket, one
+command per connection) just queues work for that loop:
+
+    run accounts | run transactions   queue an on-demand run
+    status                            last run time, duration and outcome of each job
+    stop                              finish the current job and exit
+"""
+
+class DaemonAlreadyRunning(Exception):
+    pass
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode('utf-8').strip()
+        reply = self.server.fintracker.handle_command(command)
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class FintrackerDaemon(object):
+
+    def __init__(self, email, password, robinhood_user, robinhood_pass, master_sheet,
+                 accounts_interval=ACCOUNTS_INTERVAL, transactions_interval=TRANSACTIONS_INTERVAL,
+                 control_socket=CONTROL_SOCKET_PATH, transaction_store_path=None):
+        self.email = email
+        self.password = password
+        self.robinhood_user = robinhood_user
+        self.robinhood_pass = robinhood_pass
+        self.master_sheet = master_sheet
+        self.control_socket = control_socket
+        self.transaction_store_path = transaction_store_path
+        self.mint = None
+        self.store = None
+        self.jobs = {
+            'accounts': {'interval': accounts_interval, 'func': self.run_accounts},
+            'transactions': {'interval': transactions_interval, 'func': self.run_transactions},
+        }
+        for job in self.jobs.values():
+            job.update({'next_run': time.time(), 'last_run': None, 'seconds': None, 'outcome': None})
+        self.triggers = Queue()
+        self.stopping = False
+
+    def login(self):
+        if self.mint:
+            self.mint.close()
+        print("Daemon: logging in to Mint")
+        self.mint = login_mint(self.email, self.password)
+
+    def with_mint(self, func):
+        """Calls func(mint), logging in again and retrying once if the session has expired"""
+        from .localmintapi import MintAuthError
+        if not self.mint:
+            self.login()
+        try:
+            return func(self.mint)
+        except MintAuthError as e:
+            print("Daemon: %s, re-authenticating" % e)
+            metrics.count('retries', service='mint', kind='reauth')
+            self.mint.discard_session()
+            self.login()
+            return func(self.mint)
+
+    def run_accounts(self):
+        timings = {}
+        account_types = {u'Robinhood': 'investment'}
+        findata = self.with_mint(lambda mint: collect_mint_findata(mint, timings, account_types))
+        findata[u'Robinhood'] = timed(timings, 'robinhood', get_robinhood_value, self.robinhood_user, self.robinhood_pass)
+        writer, tail = timed(timings, 'sheets_read', prepare_finances_sheet, self.master_sheet)
+        written = timed(timings, 'sheets_write', write_finances_sheet, writer, findata, tail)
+        timed(timings, 'history', record_written_balances, findata, account_types, written)
+        print_timings(timings)
+
+    def run_transactions(self):
+        if self.store is None:
+            self.store = TransactionStore(self.transaction_store_path) if self.transaction_store_path else TransactionStore()
+        changed = self.with_mint(lambda mint: mint.sync_transactions(self.store))
+        print("Daemon: synced %d new or changed transactions" % len(changed))
+
+    def run_job(self, name):
+        job = self.jobs[name]
+        print("Daemon: running %s" % name)
+        set_run_name('daemon_%s' % name)
+        metrics.reset()
+        start = time.time()
+        try:
+            job['func']()
+            job['outcome'] = 'ok'
+        except Exception as e:
+            traceback.print_exc()
+            job['outcome'] = 'error: %s' % e
+        metrics.export(ok=job['outcome'] == 'ok')
+        job['last_run'] = start
+        job['seconds'] = time.time() - start
+        job['next_run'] = start + job['interval']
+
+    def handle_command(self, command):
+        if command.startswith('run ') and command[4:] in self.jobs:
+            self.triggers.put(command[4:])
+            return {'queued': command[4:]}
+        if command == 'status':
+            return dict((name, {'last_run': job['last_run'], 'seconds': job['seconds'],
+                                'outcome': job['outcome'], 'next_run': job['next_run']})
+                        for name, job in self.jobs.items())
+        if command == 'stop':
+            self.stopping = True
+            self.triggers.put(None)
+            return {'stopping': True}
+        return {'error': 'unknown command %r, expected one of %s' % (command, ', '.join(CONTROL_COMMANDS))}
+
+    def start_control_server(self):
+        socket_dir = os.path.dirname(self.control_socket)
+        if not os.path.exists(socket_dir):
+            os.makedirs(socket_dir)
+        if os.path.exists(self.control_socket):
+            remove_stale_socket(self.control_socket)
+        server = ControlServer(self.control_socket, ControlHandler)
+        server.fintracker = self
+        os.chmod(self.control_socket, 0o600)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print("Daemon: control socket listening at %s" % self.control_socket)
+        return server
+
+    def serve_forever(self):
+        server = self.start_control_server()
+        try:
+            while not self.stopping:
+                now = time.time()
+                due = [name for name, job in self.jobs.items() if job['next_run'] <= now]
+                for name in sorted(due, key=lambda name: self.jobs[name]['next_run']):
+                    self.run_job(name)
+                next_due = min(job['next_run'] for job in self.jobs.values())
+                try:
+                    triggered = self.triggers.get(timeout=max(0, next_due - time.time()))
+                except Empty:
+                    continue
+                if triggered:
+                    self.run_job(triggered)
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.remove(self.control_socket)
+            if self.mint:
+                self.mint.close()
+            if self.store:
+                self.store.close()
+
+def remove_stale_socket(control_socket):
+    """Removes a socket file left behind by a daemon that was killed, but never one a live daemon is
+    listening on: taking that over would leave it scraping on its schedule with no way to stop it"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(control_socket)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        print("Daemon: removing stale control socket %s" % control_socket)
+        os.remove(control_socket)
+        return
+    finally:
+        probe.close()
+    raise DaemonAlreadyRunning('listening on %s' % control_socket)
+
+def send_control_command(command, control_socket=CONTROL_SOCKET_PATH):
+    """Sends one command to a running daemon and returns its decoded reply"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(control_socket)
+        client.sendall((command + '\n').encode('utf-8'))
+        reply = client.makefile('rb').readline()
+    finally:
+        client.close()
+    return json.loads(reply.decode('utf-8'))
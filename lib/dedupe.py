@@ -0,0 +1,117 @@
+from .localmintapi import assert_pd, DUPLICATE_WINDOW_DAYS, JSON_DUPLICATE_COLUMNS, CSV_DUPLICATE_COLUMNS
+
+"""
+Local duplicate detection, in place of flipping Mint's account-wide hide_duplicates property.
+
+A transaction is a duplicate when a kept one has the same account, amount and merchant (or CSV
+description) and is dated at most window_days away. Each transaction is hashed on those columns
+once, then a single sort by (hash, day) puts the candidates next to each other, so a whole history
+is checked against its sorted neighbours instead of pairwise. Only kept transactions count, so with
+a window of a day, purchases on three days in a row keep the first and the third. To check a batch
+against the synced transactions:
+
+    index = DuplicateIndex(window_days=1)
+    index.add(duplicate_keys(synced, 'date', JSON_DUPLICATE_COLUMNS, ids=synced['id']))
+    dropped = index.mark(duplicate_keys(batch, 'date', JSON_DUPLICATE_COLUMNS, ids=batch['id']))
+
+The index remembers what it has kept, so later batches are only checked against transactions that
+are already in (e.g. the synced ones near the batch's dates) and among themselves.
+"""
+
+def duplicate_keys(df, date_column, columns, ids=None):
+    """(hash, day) per transaction, indexed by ids if given.
+
+    Amounts are compared in whole cents and text case-insensitively, so a float32 CSV amount or a
+    re-cased merchant still matches.
+    """
+    np, pd = assert_pd()
+    normalized = pd.DataFrame(dict(
+        (column, (df[column].astype(np.float64) * 100).round().astype(np.int64).values if column == 'amount'
+         else df[column].astype(str).str.strip().str.lower().values)
+        for column in columns), columns=columns)
+    days = pd.to_datetime(df[date_column]).values.astype('datetime64[D]').astype(np.int64)
+    return pd.DataFrame({
+        'hash': pd.util.hash_pandas_object(normalized, index=False).values,
+        'day': days,
+    }, index=pd.Index(np.arange(len(df)), name='row') if ids is None else pd.Index(ids, name='id'))
+
+class DuplicateIndex(object):
+    """Hash index of the transactions kept so far.
+
+    Pass ids to duplicate_keys when the transactions have them (the JSON ones do, the CSV ones
+    don't): a transaction whose id is already kept is the same transaction seen again, not a copy.
+    """
+
+    def __init__(self, window_days=DUPLICATE_WINDOW_DAYS):
+        np, pd = assert_pd()
+        self.window_days = window_days
+        self.kept = pd.DataFrame({'hash': pd.Series(dtype=np.uint64), 'day': pd.Series(dtype=np.int64)},
+                                 index=pd.Index([], name='id'))
+
+    def __len__(self):
+        return len(self.kept)
+
+    def known(self, keys):
+        np, pd = assert_pd()
+        if keys.index.name != 'id':
+            return np.zeros(len(keys), dtype=bool)  # rows without ids are always new
+        return keys.index.isin(self.kept.index)
+
+    def add(self, keys):
+        """Adds transactions that are known to be kept, e.g. already synced ones, without checking them"""
+        np, pd = assert_pd()
+        self.kept = pd.concat([self.kept, keys[~self.known(keys)]])
+
+    def mark(self, keys):
+        """Returns a boolean array, True for each of keys that duplicates a kept transaction or an
+        earlier one in keys, and adds the rest to the index"""
+        np, pd = assert_pd()
+        known = self.known(keys)
+        new = keys[~known]
+        if new.empty:
+            return np.zeros(len(keys), dtype=bool)
+        hashes = np.concatenate([self.kept['hash'].values, new['hash'].values])
+        days = np.concatenate([self.kept['day'].values, new['day'].values])
+        is_new = np.arange(len(hashes)) >= len(self.kept)
+
+        # kept transactions sort ahead of new ones on the same day, and new ones keep their order
+        order = np.lexsort((np.arange(len(hashes)), is_new, days, hashes))
+        hashes, days, is_new = hashes[order], days[order], is_new[order]
+        # a new transaction dated just before an already kept one is a copy of it
+        positions = np.arange(len(order))
+        next_kept = np.minimum.accumulate(np.where(is_new, len(order), positions)[::-1])[::-1]
+        next_kept = np.append(next_kept[1:], len(order))
+        has_next = next_kept < len(order)
+        following = next_kept[has_next]
+        duplicate = np.zeros(len(order), dtype=bool)
+        duplicate[has_next] = ((hashes[following] == hashes[has_next]) &
+                               (days[following] - days[has_next] <= self.window_days))
+        duplicate &= is_new
+
+        # and one dated at most window_days after the last kept one is too. Only a transaction whose
+        # sorted neighbour is that close can be one, and whether it is depends on whether the rows
+        # before it were kept, so just those are settled in order, looking back past the dropped ones
+        near_previous = np.zeros(len(order), dtype=bool)
+        near_previous[1:] = (hashes[1:] == hashes[:-1]) & (days[1:] - days[:-1] <= self.window_days)
+        for i in np.flatnonzero(near_previous & is_new & ~duplicate):
+            j = i - 1
+            while j >= 0 and hashes[j] == hashes[i] and days[i] - days[j] <= self.window_days:
+                if not duplicate[j]:
+                    duplicate[i] = True
+                    break
+                j -= 1
+
+        duplicate_new = np.empty(len(order), dtype=bool)
+        duplicate_new[order] = duplicate
+        duplicate_new = duplicate_new[len(self.kept):]
+        self.kept = pd.concat([self.kept, new[~duplicate_new]])
+
+        marked = np.zeros(len(keys), dtype=bool)
+        marked[~known] = duplicate_new
+        return marked
+
+def find_duplicates(df, date_column, columns, ids=None, window_days=DUPLICATE_WINDOW_DAYS, index=None):
+    """Boolean array marking the duplicates in df, checked against index (and added to it) if given"""
+    if index is None:
+        index = DuplicateIndex(window_days)
+    return index.mark(duplicate_keys(df, date_column, columns, ids))
@@ -0,0 +1,95 @@
+from .localmintapi import assert_pd
+
+SHEET_DATE_FORMAT = '%-m/%-d/%Y'
+# CSV columns Mint never lets the user edit; category, description, labels and notes all change on edits
+CSV_KEY_COLUMNS = ['date', 'original_description', 'amount', 'transaction_type', 'account_name']
+
+def spending_frame(df):
+    """Normalizes a transactions DataFrame into key-indexed (date, category, amount) rows, spending positive.
+
+    Accepts either Mint.get_detailed_transactions output (odate, signed amount, id) or Mint.get_transactions
+    CSV output (date, unsigned amount, transaction_type). CSV rows have no id, so they are keyed by a hash
+    of their CSV_KEY_COLUMNS plus how many rows with the same hash came before: two same-day coffees at
+    the same place stay two rows, and each still matches its own copy from the previous download, even
+    after it was recategorized or renamed in Mint.
+    """
+    np, pd = assert_pd()
+    if 'odate' in df.columns:
+        dates = df['odate']
+        amounts = df['amount'].astype(np.float64).values
+        keys = df['id'].values
+    else:
+        dates = df['date']
+        amounts = df['amount'].astype(np.float64).values
+        amounts = np.where(df['transaction_type'].astype(str).values == 'credit', -amounts, amounts)
+        row_hashes = pd.Series(pd.util.hash_pandas_object(df[CSV_KEY_COLUMNS], index=False).values)
+        keys = pd.util.hash_pandas_object(pd.DataFrame({
+            'row': row_hashes.values,
+            'occurrence': row_hashes.groupby(row_hashes).cumcount().values,
+        }), index=False).values
+    categories = df['category'].astype(object).where(df['category'].notna(), 'uncategorized')
+    return pd.DataFrame({
+        'date': pd.to_datetime(dates).dt.normalize().values,
+        'category': categories.str.lower().values,
+        'amount': amounts,
+    }, index=pd.Index(keys, name='key'))
+
+def aggregate_daily(spending):
+    """day x category sums of a spending_frame"""
+    return spending.groupby(['date', 'category'])['amount'].sum().unstack(fill_value=0.0)
+
+class ExpenseMatrix(object):
+    """Dense day x category spending matrix built from a transactions DataFrame.
+
+    merge() upserts a batch of transactions by key and recomputes only the days that batch touches
+    (including the old day of a transaction whose date changed), so a daily sync stays cheap on top
+    of years of history.
+    """
+
+    def __init__(self, categories=None):
+        np, pd = assert_pd()
+        self.fixed_categories = [c.lower() for c in categories] if categories else None
+        self.spending = pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'),
+                                      'category': pd.Series(dtype=object),
+                                      'amount': pd.Series(dtype=np.float64)},
+                                     index=pd.Index([], name='key'))
+        self.matrix = pd.DataFrame(dtype=np.float64)
+
+    @classmethod
+    def from_transactions(cls, df, categories=None):
+        matrix = cls(categories)
+        matrix.merge(df)
+        return matrix
+
+    @property
+    def categories(self):
+        return list(self.matrix.columns)
+
+    def merge(self, df):
+        """Merges a batch of transactions and returns the DatetimeIndex of days that were recomputed"""
+        np, pd = assert_pd()
+        batch = spending_frame(df)
+        batch = batch[~batch.index.duplicated(keep='last')]
+        replaced = self.spending.index.isin(batch.index)
+        touched = pd.DatetimeIndex(batch['date'].unique()).union(
+            pd.DatetimeIndex(self.spending.loc[replaced, 'date'].unique()))
+        self.spending = pd.concat([self.spending[~replaced], batch])
+        if touched.empty:
+            return touched
+
+        recomputed = aggregate_daily(self.spending[self.spending['date'].isin(touched)])
+        days = pd.date_range(min(self.spending['date'].min(), touched.min()),
+                             max(self.spending['date'].max(), touched.max()), freq='D')
+        columns = self.fixed_categories or sorted(set(self.matrix.columns) | set(recomputed.columns))
+        matrix = self.matrix.reindex(index=days, columns=columns, fill_value=0.0)
+        matrix.loc[touched] = recomputed.reindex(index=touched, columns=columns, fill_value=0.0).values
+        self.matrix = matrix.round(2)
+        return touched
+
+    def rows(self, categories=None):
+        """Yields sheet rows of [day, amount per category], oldest day first"""
+        columns = [c.lower() for c in categories] if categories else self.categories
+        values = self.matrix.reindex(columns=columns, fill_value=0.0).values.tolist()
+        for day, row in zip(self.matrix.index.strftime(SHEET_DATE_FORMAT), values):
+            row.insert(0, day)
+            yield row
@@ -0,0 +1,175 @@
+import itertools
+import json
+import re
+import time
+
+A1_RANGE_REGEX = re.compile(r"^(?:'?([^'!]+)'?!)?([A-Z]+)?(\d+)?(?::([A-Z]+)?(\d+)?)?$")
+
+"""
+In-memory stand-ins for the parts of the Google APIs fintracker calls, so flows like the MFA email
+wait or the sheet updates can be exercised offline. They mimic the discovery client shape:
+service.users().messages().list(...).execute().
+
+    gmail = FakeGmailService()
+    gmail.deliver('Your Mint code is: 123456 ...', delay=5)
+    wait_for_mint_verification_code(since=time.time(), service=gmail)
+
+    sheets = FakeSheetsService()
+    update_finances_sheet(sheet_id, findata, writer=SheetsWriter(sheets, sheet_id, state_path, snapshot_path))
+"""
+
+class FakeRequest(object):
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        return self.func(*self.args)
+
+class FakeGmailMessages(object):
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, q='', maxResults=100, **kwargs):
+        return FakeRequest(self.gmail.list_messages, q, maxResults)
+
+    def get(self, userId, id, format='full', **kwargs):
+        return FakeRequest(self.gmail.get_message, id)
+
+class FakeGmailService(object):
+    """Fake Gmail service holding delivered messages in memory.
+
+    Messages only become visible once their delivery time has passed, list() understands plain
+    subject words and after:<epoch seconds>, and every list/get is recorded in self.calls.
+    """
+
+    def __init__(self):
+        self.inbox = []
+        self.calls = []
+        self.ids = itertools.count(1)
+
+    def deliver(self, snippet, subject='Verify your Mint account', delay=0, at=None):
+        """Adds a message that arrives `delay` seconds from now, or at epoch time `at`"""
+        message = {
+            'id': '%x' % next(self.ids),
+            'subject': subject,
+            'snippet': snippet,
+            'internalDate': str(int((at if at is not None else time.time() + delay) * 1000)),
+        }
+        self.inbox.append(message)
+        return message
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return FakeGmailMessages(self)
+
+    def list_messages(self, query, max_results):
+        self.calls.append(('list', query))
+        now_ms = time.time() * 1000
+        after = re.search(r'after:(\d+)', query)
+        words = re.sub(r'after:\d+', '', query).strip()
+        matches = [
+            m for m in self.inbox
+            if int(m['internalDate']) <= now_ms
+            and words in m['subject']
+            and (not after or int(m['internalDate']) > int(after.group(1)) * 1000)
+        ]
+        matches.sort(key=lambda m: int(m['internalDate']), reverse=True)  # newest first, like gmail
+        if not matches:
+            return {'resultSizeEstimate': 0}
+        return {'messages': [{'id': m['id'], 'threadId': m['id']} for m in matches[:max_results]]}
+
+    def get_message(self, message_id):
+        self.calls.append(('get', message_id))
+        for message in self.inbox:
+            if message['id'] == message_id:
+                return dict(message)
+        raise KeyError(message_id)
+
+def column_index(letters):
+    """A -> 0, Z -> 25, AA -> 26"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def parse_a1_range(range_name):
+    """Returns (tab, first_row, first_col, last_row, last_col), 0 based, with None for open ends"""
+    match = A1_RANGE_REGEX.match(range_name)
+    if not match:
+        raise ValueError('Unable to parse range: %s' % range_name)
+    tab, first_col, first_row, last_col, last_row = match.groups()
+    if ':' not in range_name:  # a single cell
+        last_col, last_row = first_col, first_row
+    return (tab or 'Sheet1',
+            int(first_row) - 1 if first_row else 0,
+            column_index(first_col) if first_col else 0,
+            int(last_row) - 1 if last_row else None,
+            column_index(last_col) if last_col else None)
+
+class FakeSheetsValues(object):
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self.sheets.get_values, spreadsheetId, range)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return FakeRequest(self.sheets.batch_update, spreadsheetId, body)
+
+class FakeSheetsService(object):
+    """Fake Sheets service keeping every spreadsheet as {tab: [[cell, ...], ...]} in memory.
+
+    values().get trims trailing empty rows and cells the way the real API does, batchUpdate leaves
+    None cells untouched, and every call is recorded in self.calls along with the request body size,
+    so a benchmark can count round trips and bytes sent.
+    """
+
+    def __init__(self):
+        self.spreadsheets_data = {}
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeSheetsValues(self)
+
+    def tab(self, spreadsheet_id, tab):
+        return self.spreadsheets_data.setdefault(spreadsheet_id, {}).setdefault(tab, [])
+
+    def get_values(self, spreadsheet_id, range_name):
+        self.calls.append(('get', range_name, 0))
+        tab, first_row, first_col, last_row, last_col = parse_a1_range(range_name)
+        grid = self.tab(spreadsheet_id, tab)
+        rows = grid[first_row:None if last_row is None else last_row + 1]
+        values = [row[first_col:None if last_col is None else last_col + 1] for row in rows]
+        for row in values:
+            while row and row[-1] in (None, ''):
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return {'range': range_name, 'values': values} if values else {'range': range_name}
+
+    def batch_update(self, spreadsheet_id, body):
+        self.calls.append(('batchUpdate', [data['range'] for data in body['data']], len(json.dumps(body))))
+        updated_cells = 0
+        for data in body['data']:
+            tab, first_row, first_col, _, _ = parse_a1_range(data['range'])
+            grid = self.tab(spreadsheet_id, tab)
+            for row_offset, row in enumerate(data['values']):
+                row_index = first_row + row_offset
+                while len(grid) <= row_index:
+                    grid.append([])
+                target = grid[row_index]
+                for col_offset, value in enumerate(row):
+                    if value is None:
+                        continue
+                    col = first_col + col_offset
+                    while len(target) <= col:
+                        target.append(None)
+                    target[col] = value
+                    updated_cells += 1
+        return {'spreadsheetId': spreadsheet_id, 'totalUpdatedCells': updated_cells}
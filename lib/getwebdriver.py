@@ -1,102 +1,328 @@
 from selenium import webdriver
 from selenium.common import exceptions
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 from seleniumrequests import Chrome
-from .googleapi import get_mint_email_verification_code
+from . import ROOT_DIR, CACHE_DIR
+from .metrics import metrics
+import io
 import time
 import urllib
-import inspect
 import os
 
-def get_headless_web_driver():
+try:
+    import fcntl
+except ImportError:  # not on Windows; persistent profiles are then used without a lock
+    fcntl = None
+
+try:
+    import psutil
+except ImportError:  # browser memory isn't recorded without it
+    psutil = None
+
+MINT_OVERVIEW_URL = 'https://mint.intuit.com/overview.event'
+
+# Opt-in persistent Chrome profile. It keeps the http cache between runs, but also Mint's session and
+# device cookies in plain text outside the encrypted session store, so it is off unless this is set.
+BROWSER_PROFILE_DIR_ENV = 'FINTRACKER_CHROME_PROFILE_DIR'
+BROWSER_PROFILE_DIR = os.environ.get(BROWSER_PROFILE_DIR_ENV) or None
+PAGE_TIMEOUT = 20  # seconds to wait for an element of the login form
+
+LEAN_CHROME_ARGUMENTS = [
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-dev-shm-usage',
+    '--disable-background-networking',
+    '--no-first-run',
+    '--mute-audio',
+]
+
+# skipped through devtools, the login and overview pages work without them
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*doubleclick.net*', '*google-analytics.com*', '*googletagmanager.com*',
+    '*facebook.net*', '*demdex.net*', '*omtrdc.net*', '*hotjar.com*',
+]
+
+LOGIN_ATTEMPTS = 3  # fresh browsers to try before giving up on getting to the login form
+LOGIN_POLL_FREQUENCY = 0.25  # seconds between page state checks
+STATE_TIMEOUT = 60  # seconds to wait for the page to leave a state after acting on it
+CODE_ATTEMPTS = 2
+
+STATE_SIGNED_IN = 'signed_in'
+STATE_FAILED = 'failed'
+STATE_CHALLENGE = 'challenge'
+STATE_CODE_SENT = 'code_sent'
+STATE_SIGNING_IN = 'signing_in'
+STATE_UNKNOWN = 'unknown'
+
+# checked in order against a single read of the page source
+LOGIN_STATE_MARKERS = [
+    (STATE_FAILED, "Hmm. That didn't work."),
+    (STATE_CODE_SENT, "Check your email"),
+    (STATE_CHALLENGE, "Let's make sure it's you"),
+    (STATE_SIGNING_IN, "Signing In ..."),
+]
+
+class LoginError(Exception):
+    pass
+
+def get_headless_web_driver(page_load_strategy='eager', block_resources=True, user_data_dir=None):
+    """Starts a lean headless Chrome.
+
+    Args:
+      page_load_strategy: 'eager' returns from get() at DOMContentLoaded instead of waiting for every
+        subresource; the login flow waits on the elements it needs explicitly anyway
+      block_resources: skip images, web fonts and third-party analytics, none of which the scraper reads
+      user_data_dir: persistent profile dir so the http cache (and device cookies) survive between runs;
+        defaults to BROWSER_PROFILE_DIR (unset unless opted in), False for a throwaway profile. Two running
+        browsers can't share one dir, so if another process has it locked a throwaway profile is used instead.
+    """
+    if user_data_dir is None:
+        user_data_dir = BROWSER_PROFILE_DIR
+    profile_lock = lock_profile_dir(user_data_dir) if user_data_dir else None
+    if user_data_dir and profile_lock is False:
+        print("Chrome profile %s is in use by another process, using a throwaway profile" % user_data_dir)
+        user_data_dir = None
     options = webdriver.ChromeOptions()
     options.set_headless(headless=True)
-    driver = Chrome(chrome_options=options)
+    for argument in LEAN_CHROME_ARGUMENTS:
+        options.add_argument(argument)
+    if block_resources:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    if user_data_dir:
+        options.add_argument('--user-data-dir=%s' % user_data_dir)
+
+    capabilities = DesiredCapabilities.CHROME.copy()
+    capabilities['pageLoadStrategy'] = page_load_strategy
+    start = time.time()
+    with metrics.span('browser_launch'):
+        driver = Chrome(chrome_options=options, desired_capabilities=capabilities)
+        driver.profile_lock = profile_lock  # held for as long as this browser is around
+
+        if block_resources:
+            try:
+                driver.execute_cdp_cmd('Network.enable', {})
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+            except exceptions.WebDriverException as e:
+                print("Could not block resources through devtools: %s" % e)
+    print("Chrome started in %.2fs" % (time.time() - start))
+    record_browser_rss(driver, 'launch')
 
     return driver
 
+def browser_rss(driver):
+    """Resident memory in bytes of chromedriver plus every Chrome process under it, or None without psutil"""
+    if not psutil:
+        return None
+    try:
+        driver_process = psutil.Process(driver.service.process.pid)
+        processes = [driver_process] + driver_process.children(recursive=True)
+    except (AttributeError, psutil.NoSuchProcess):
+        return None
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+def record_browser_rss(driver, stage):
+    """Records the browser's resident memory at stage ('launch', 'logged_in') as a metrics peak"""
+    rss = browser_rss(driver)
+    if rss is not None:
+        metrics.record_peak('browser_rss_bytes', rss, stage=stage)
+        print("Chrome using %.0fMB after %s" % (rss / 1e6, stage))
+
+def lock_profile_dir(user_data_dir):
+    """Takes an exclusive lock next to a profile dir. Returns the open lock file, which holds the lock
+    until it is closed or the process exits, False if another process holds it, or None without fcntl"""
+    if fcntl is None:
+        return None
+    lock_path = user_data_dir.rstrip(os.sep) + '.lock'
+    if not os.path.isdir(os.path.dirname(lock_path)):
+        os.makedirs(os.path.dirname(lock_path))
+    lockfile = open(lock_path, 'a')
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lockfile.close()
+        return False
+    return lockfile
+
 def get_logged_in_driver(email, password):
+    """Starts a headless browser, opens the Mint login form and submits the credentials.
+
+    Returns None if the form couldn't be filled in, after quitting the browser.
+    """
+    print("Creating headless webdriver")
+    driver = get_headless_web_driver()
     try:
-        print("Creating headless webdriver")
-        driver = get_headless_web_driver()
+        wait = WebDriverWait(driver, PAGE_TIMEOUT)
 
         mint_url = "https://www.mint.com"
         print("Navigating to %s" % mint_url)
         driver.get(mint_url)
-        driver.implicitly_wait(20)  # seconds
 
         print("Mint: clicking Log In")
-        driver.find_element_by_link_text("Log In").click()
+        wait.until(EC.element_to_be_clickable((By.LINK_TEXT, "Log In"))).click()
         # driver.find_element_by_class_name("js-auth-slider-toggle--login.btn.btn-primary").click()
         # the below url is what clicking "Log In" should bring you to, but its extremely obnoxious
         # driver.get("https://accounts.intuit.com/index.html?offering_id=Intuit.ifs.mint&namespace_id=50000026&redirect_url=https%3A%2F%2Fmint.intuit.com%2Foverview.event%3Futm_medium%3Ddirect%26cta%3Dnav_login_dropdown%26adobe_mc%3DMCMID%253D77002298059235586230670777420121551141%257CMCORGID%253D969430F0543F253D0A4C98C6%252540AdobeOrg%257CTS%253D1547966883%26ivid%3D3fb14f1c-243e-488a-bfa7-d16933881ab3")
 
         print("Mint: sending user")
-        driver.find_element_by_id("ius-userid").send_keys(email)
+        wait.until(EC.visibility_of_element_located((By.ID, "ius-userid"))).send_keys(email)
         print("Mint: sending pass")
         driver.find_element_by_id("ius-password").send_keys(password)
         print("Mint: submitting")
         driver.find_element_by_id("ius-sign-in-submit-btn").submit()
 
         return driver
-    except exceptions.NoSuchElementException as e:
+    except (exceptions.NoSuchElementException, exceptions.TimeoutException) as e:
         print(e)
         print("Writing page source to html/exceptionpage.html")
-        dir_path = os.path.dirname(inspect.stack()[-1][1]) # inspect.stack returns stack of calls, -1 is first aka original calling script. [1] is the filename
-        filepath = os.path.join(dir_path, 'html/exceptionpage.html')
-        with open(filepath, 'w') as htmlfile:
-            htmlfile.write(driver.page_source.encode('utf-8'))
+        save_page_source(driver, 'exceptionpage.html')
         print("Quitting bad webdriver")
         driver.quit()
 
         return None
 
+def save_page_source(driver, filename):
+    filepath = os.path.join(ROOT_DIR, 'html', filename)
+    with io.open(filepath, 'w', encoding='utf-8') as htmlfile:
+        htmlfile.write(driver.page_source)
 
-def get_mint_page(email, password):
-    driver = None
-    while not driver:
-        driver = get_logged_in_driver(email, password)
+def get_login_state(driver):
+    """Classifies the login page, reading the url and the page source only once"""
+    if driver.current_url.startswith(MINT_OVERVIEW_URL):
+        return STATE_SIGNED_IN
+    source = driver.page_source
+    for state, marker in LOGIN_STATE_MARKERS:
+        if marker in source:
+            return state
+    return STATE_UNKNOWN
 
-    # Wait until logged in, just in case we need to deal with MFA.
-    email_sent = False
-    while not driver.current_url.startswith('https://mint.intuit.com/overview.event'):
-        if "Hmm. That didn't work." in driver.page_source:
+class login_state_changed(object):
+    """WebDriverWait condition that returns the new login state once the page has left `state`"""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __call__(self, driver):
+        state = get_login_state(driver)
+        return state if state != self.state else False
+
+def choose_email_challenge(driver):
+    print("Mint: CHALLENGE PRESENTED")
+    WebDriverWait(driver, STATE_TIMEOUT).until(EC.element_to_be_clickable((By.ID, "ius-mfa-option-email"))).click()
+    print("Mint: CHOSE EMAIL OPTION")
+    challenge_time = time.time()
+    driver.find_element_by_id("ius-mfa-options-submit-btn").submit()
+    print("Mint: SUBMITTED CONTINUE BUTTON")
+    return challenge_time
+
+def enter_verification_code(driver, since, skip_codes=()):
+    """Waits for a code emailed after `since` that isn't in skip_codes, enters it and returns it"""
+    print("Mint: MADE IT TO NEXT CHECKPOINT, WAITING FOR EMAIL")
+    from .googleapi import wait_for_mint_verification_code  # only needed when Mint asks for a code
+    with metrics.span('mfa_wait'):
+        code = wait_for_mint_verification_code(since=since, skip_codes=skip_codes)
+    print("Mint: GOT VERIFICATION CODE... %s" % code)
+    print("Mint: SENDING KEYS %s TO INPUT FIELD" % code)
+    code_input = WebDriverWait(driver, STATE_TIMEOUT).until(EC.presence_of_element_located((By.ID, "ius-mfa-confirm-code")))
+    code_input.clear()
+    code_input.send_keys(code)
+    print("Mint: CLICKING CONTINUE BUTTON")
+    driver.find_element_by_id("ius-mfa-otp-submit-btn").submit()
+    return code
+
+def complete_login(driver):
+    """Drives the post-submit login pages (MFA challenge, email code) until the overview page loads.
+
+    Each tick reads the page state once; between actions it waits on login_state_changed rather than
+    sleeping, so every transition is picked up as soon as the site makes it. Prints how long was spent
+    in each state.
+
+    Raises:
+      LoginError if the credentials are rejected, a state doesn't change within STATE_TIMEOUT, or the
+      verification code is rejected CODE_ATTEMPTS times.
+    """
+    state_timings = {}
+    code_since = None  # when the challenge was answered, then when the last code was submitted
+    entered_codes = set()
+    code_attempts = 0
+    state = get_login_state(driver)
+    while state != STATE_SIGNED_IN:
+        entered = time.time()
+        if state == STATE_FAILED:
             print("Mint: LOGIN FAILED")
-        elif "Check your email" in driver.page_source and email_sent:
-            print("Mint: MADE IT TO NEXT CHECKPOINT, WAITING 60 SECONDS FOR EMAIL")
-            time.sleep(60)
-            code = get_mint_email_verification_code()
-            print("Mint: GOT VERIFICATION CODE... %s" % code)
-            print("Mint: SENDING KEYS %s TO INPUT FIELD" % code)
-            driver.find_element_by_id("ius-mfa-confirm-code").send_keys(code)
-            print("Mint: CLICKING CONTINUE BUTTON")
-            driver.find_element_by_id("ius-mfa-otp-submit-btn").submit()
-        elif "Let's make sure it's you" in driver.page_source:
-            print("Mint: CHALLENGE PRESENTED")
-            driver.find_element_by_id("ius-mfa-option-email").click()
-            print("Mint: CHOSE EMAIL OPTION")
-            driver.find_element_by_id("ius-mfa-options-submit-btn").submit()
-            print("Mint: SUBMITTED CONTINUE BUTTON")
-            email_sent = True
-        elif "Signing In ..." in driver.page_source:
+            raise LoginError("Mint rejected the login")
+        elif state == STATE_CHALLENGE:
+            code_since = choose_email_challenge(driver)
+        elif state == STATE_CODE_SENT:
+            code_attempts += 1
+            if code_attempts > CODE_ATTEMPTS:
+                metrics.count('errors', service='mint', kind='verification_code')
+                raise LoginError("Mint did not accept the verification code")
+            if code_attempts > 1:
+                metrics.count('retries', service='mint', kind='verification_code')
+            # a retry must wait for a newer email than the code that was just rejected
+            code = enter_verification_code(driver, code_since or entered, entered_codes)
+            code_since = time.time()
+            entered_codes.add(code)  # never entered twice if the page stays on CODE_SENT
+        elif state == STATE_SIGNING_IN:
             print("Signing In ...")
         else:
             print("Encountered unhandled login response, saving page to html/unhandledheadlesspage.html")
-            dir_path = os.path.dirname(inspect.stack()[-1][1]) # inspect.stack returns stack of calls, -1 is first aka original calling script. [1] is the filename
-            filepath = os.path.join(dir_path, 'html/unhandledheadlesspage.html')
-            with open(filepath, 'w') as htmlfile:
-                htmlfile.write(driver.page_source.encode('utf-8'))
-        # url = urllib.unquote(driver.current_url) # for python2
-        # print(url)
-        # print(urllib.parse.unquote(driver.current_url)) # for python3
-        time.sleep(1)
+            save_page_source(driver, 'unhandledheadlesspage.html')
+
+        try:
+            new_state = WebDriverWait(driver, STATE_TIMEOUT, poll_frequency=LOGIN_POLL_FREQUENCY).until(login_state_changed(state))
+        except exceptions.TimeoutException:
+            if state != STATE_CODE_SENT:
+                raise LoginError("Mint login stuck in state %s for %ds" % (state, STATE_TIMEOUT))
+            new_state = state  # the code may have been rejected, go round again with a fresh one
+        state_timings[state] = state_timings.get(state, 0) + time.time() - entered
+        metrics.record_span('login_%s' % state, time.time() - entered)
+        state = new_state
+
+    print("Mint: login state timings: %s" % ', '.join('%s %.1fs' % item for item in state_timings.items()))
+
+def get_mint_page(email, password):
+    """Logs in and returns a driver on the Mint overview page"""
+    logged_in = None
+    for attempt in range(LOGIN_ATTEMPTS):
+        if attempt:
+            metrics.count('retries', service='mint', kind='login_form')
+        with metrics.span('login_form'):
+            logged_in = get_logged_in_driver(email, password)
+        if logged_in:
+            break
+    if not logged_in:
+        raise LoginError("Could not reach the Mint login form after %d attempts" % LOGIN_ATTEMPTS)
+
+    # Wait until logged in, just in case we need to deal with MFA.
+    try:
+        complete_login(logged_in)
+    except Exception:
+        print("Quitting webdriver after failed login")
+        logged_in.quit()
+        raise
+    driver = logged_in
 
     # The normal flow can lead to a "It may have been moved or deleted" error in headless mode, so the following get() can be used as a workaround
     # Leaving it commented out until I run into the error again
     # driver.get("https://mint.intuit.com/overview.event?utm_medium=direct&cta=nav_login_dropdown")
-    driver.implicitly_wait(60)  # wait up to 60s to find the transactions button.  The page can take a little while to load so I want to give it plenty
     print("Finding transactions...")
-    driver.find_element_by_id("transaction")
+    # wait up to 60s to find the transactions button.  The page can take a little while to load so I want to give it plenty
+    WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.ID, "transaction")))
     print("Found transactions")
+    record_browser_rss(driver, 'logged_in')
 
     return driver
@@ -2,22 +2,69 @@ import os
 from httplib2 import Http
 from datetime import datetime
 from apiclient import discovery, errors
+from googleapiclient.discovery_cache.base import Cache
 from oauth2client.file import Storage
 from oauth2client import client, tools
 import sys
 from email.mime.text import MIMEText
 import base64
+import hashlib
+import json
+import threading
+import time
 from pprint import pprint
-import inspect
 from const.CONSTANTS import SHEET_COLS
+from . import ROOT_DIR, CACHE_DIR
+from .sheetdiff import diff_rows, normalize
+from .metrics import metrics
+from .atomicfile import locked, write_atomic
+
+CREDS_DIR = os.path.join(ROOT_DIR, 'creds')
+DISCOVERY_CACHE_DIR = os.path.join(CACHE_DIR, 'discovery')
+DISCOVERY_CACHE_TTL = 24 * 60 * 60  # seconds
+SHEETS_STATE_PATH = os.path.join(CACHE_DIR, 'sheets_state.json')
+SHEETS_SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'sheets_snapshot.json')
+
+SHEETS_SCOPE = 'https://www.googleapis.com/auth/spreadsheets'
+SHEETS_DISCOVERY_URL = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+GMAIL_READONLY_SCOPE = 'https://www.googleapis.com/auth/gmail.readonly'
+GMAIL_SEND_SCOPE = 'https://www.googleapis.com/auth/gmail.send'
+
+MINT_VERIFICATION_QUERY = 'Verify your Mint account'
+VERIFICATION_CLOCK_SKEW = 10  # seconds of leeway between our clock and gmail's
+
+_services = {}
+_services_lock = threading.Lock()
+
+class DiscoveryFileCache(Cache):
+    """On-disk cache for discovery documents, so building a service doesn't refetch them every run"""
+
+    def __init__(self, cache_dir=DISCOVERY_CACHE_DIR, ttl=DISCOVERY_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def path_for(self, url):
+        return os.path.join(self.cache_dir, '%s.json' % hashlib.sha256(url.encode('utf-8')).hexdigest()[:16])
+
+    def get(self, url):
+        path = self.path_for(url)
+        if not os.path.exists(path) or time.time() - os.path.getmtime(path) > self.ttl:
+            return None
+        with open(path) as docfile:
+            return docfile.read()
+
+    def set(self, url, content):
+        write_atomic(self.path_for(url), content)
+
+def set_creds_dir(path):
+    """Points credential lookups at another creds dir, e.g. one per profile in a batch worker process"""
+    global CREDS_DIR
+    CREDS_DIR = path
 
 def get_credentials(app, scopes, app_name):
     # If modifying these scopes, delete your previously saved credentials
     abbreviated_scopes = '-'.join([x.split('/')[-1] for x in scopes.split(',')])
     print("Pulling credentials for: %s" % abbreviated_scopes)
-    # dir_path = os.path.dirname(os.path.realpath(__file__))
-    dir_path = os.path.dirname(inspect.stack()[-1][1]) # inspect.stack returns stack of calls, -1 is first aka original calling script. [1] is the filename
-    CREDS_DIR = os.path.join(dir_path, 'creds')
     CLIENT_SECRET_FILE = '%s/%s/%s.client_secret.json' % (CREDS_DIR, app, app)
 
     credential_dir = '%s/%s' % (CREDS_DIR, app)
@@ -38,18 +85,75 @@ def get_credentials(app, scopes, app_name):
         print('Storing credentials to ' + CREDS_PATH)
     return credentials
 
+def get_service(api, version, app, scopes, app_name=None, discovery_url=None):
+    """Builds each (api, version, scopes) service once per process and hands the same object back afterwards.
+
+    The service keeps its authorized Http, so connections are reused across calls. httplib2 isn't
+    thread safe, so a service shouldn't be used from two threads at the same time.
+    """
+    key = (api, version, scopes)
+    with _services_lock:
+        if key not in _services:
+            creds = get_credentials(app=app, scopes=scopes, app_name=app_name)
+            kwargs = {'discoveryServiceUrl': discovery_url} if discovery_url else {}
+            _services[key] = discovery.build(api, version, http=creds.authorize(Http()), cache=DiscoveryFileCache(), **kwargs)
+        return _services[key]
+
 
-def get_mint_email_verification_code():
-    # Setup the Gmail API
-    creds = get_credentials(app='mail', scopes='https://www.googleapis.com/auth/gmail.readonly', app_name=None)
-    service = discovery.build('gmail', 'v1', http=creds.authorize(Http()))
+def execute_request(service, endpoint, request):
+    """Executes a discovery client request, recording it in the run metrics"""
+    start = time.time()
+    try:
+        result = request.execute()
+    except errors.HttpError as e:
+        status = getattr(e, 'resp', None) and e.resp.status
+        metrics.record_request(service, endpoint, status or 'error', 0, time.time() - start)
+        metrics.count('errors', service=service, kind='http_%s' % status)
+        raise
+    metrics.record_request(service, endpoint, 200, len(json.dumps(result)), time.time() - start)
+    return result
+
+class VerificationCodeTimeout(Exception):
+    pass
+
+def parse_mint_verification_code(snippet):
+    return snippet.split(': ')[1].split(' ')[0]
 
-    # Call the Gmail API
-    response = service.users().messages().list(userId='me', q='Verify your Mint account').execute()
-    msg_data = response['messages'][0]
-    message = service.users().messages().get(userId='me', id=msg_data['id'], format='raw').execute()
-    ver_code = message['snippet'].split(': ')[1].split(' ')[0]
-    return ver_code
+def wait_for_mint_verification_code(since, timeout=300, initial_delay=2, max_delay=30, service=None, skip_codes=()):
+    """Polls Gmail for a Mint verification email received after `since` (epoch seconds) and returns its code.
+
+    Polls back off exponentially from initial_delay up to max_delay. Each poll is a single messages().list
+    narrowed with an after: query, so it usually comes back empty, and a message is only accepted if its
+    internalDate is newer than the challenge, never a stale code from an earlier login. Codes in
+    skip_codes (e.g. one Mint just rejected) are passed over even if their email is within the clock skew.
+
+    Raises:
+      VerificationCodeTimeout if no new code arrives within timeout seconds.
+    """
+    if service is None:
+        service = get_service('gmail', 'v1', app='mail', scopes=GMAIL_READONLY_SCOPE)
+    query = '%s after:%d' % (MINT_VERIFICATION_QUERY, int(since - VERIFICATION_CLOCK_SKEW))
+    deadline = time.time() + timeout
+    delay = initial_delay
+    checked = set()
+    while True:
+        time.sleep(max(0, min(delay, deadline - time.time())))
+        metrics.count('mfa_polls')
+        response = execute_request('gmail', 'messages.list', service.users().messages().list(userId='me', q=query, maxResults=5))
+        for msg_data in response.get('messages', []):
+            if msg_data['id'] in checked:
+                continue
+            checked.add(msg_data['id'])
+            message = execute_request('gmail', 'messages.get', service.users().messages().get(userId='me', id=msg_data['id'], format='minimal'))
+            if int(message['internalDate']) / 1000.0 >= since - VERIFICATION_CLOCK_SKEW:
+                code = parse_mint_verification_code(message['snippet'])
+                if code not in skip_codes:
+                    return code
+        if time.time() >= deadline:
+            metrics.count('errors', service='gmail', kind='verification_timeout')
+            raise VerificationCodeTimeout('No Mint verification email after %d seconds' % timeout)
+        print("Mint: no verification email yet, checking again in %ds" % min(delay * 2, max_delay))
+        delay = min(delay * 2, max_delay)
 
 def create_message(sender, to, subject, message_text):
   message = MIMEText(message_text)
@@ -67,8 +171,7 @@ def send_message(service, user_id, message):
     print('An error occurred: %s' % error)
 
 def send_email(sender, to, subject, body):
-    creds = get_credentials(app='mail', scopes='https://www.googleapis.com/auth/gmail.send', app_name=None)
-    service = discovery.build('gmail', 'v1', http=creds.authorize(Http()))
+    service = get_service('gmail', 'v1', app='mail', scopes=GMAIL_SEND_SCOPE)
 
     msg = create_message(sender, to, subject, body)
     user_id = 'me'
@@ -80,76 +183,184 @@ def print_findata_values(findata):
     except Exception as e:
         print("Exception was: %s" % e)
 
-def update_finances_sheet(master_sheet, findata):
-    print_findata_values(findata)
-    print("Updating finances sheet")
-    creds = get_credentials(app='sheets', scopes='https://www.googleapis.com/auth/spreadsheets', app_name='Google Sheets API Python Quickstart')
-    discoveryUrl = ('https://sheets.googleapis.com/$discovery/rest?version=v4')
-    service = discovery.build('sheets', 'v4', http=creds.authorize(Http()), discoveryServiceUrl=discoveryUrl)
+def get_sheets_service():
+    return get_service('sheets', 'v4', app='sheets', scopes=SHEETS_SCOPE,
+                       app_name='Google Sheets API Python Quickstart', discovery_url=SHEETS_DISCOVERY_URL)
+
+def load_sheets_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as statefile:
+        return json.load(statefile)
+
+def save_sheets_state(state, path):
+    write_atomic(path, json.dumps(state, indent=2))
+
+def update_sheets_state(path, spreadsheet_id, value):
+    """Replaces one spreadsheet's entry in a state file shared by every profile, under a lock so
+    concurrent batch workers don't drop each other's entries"""
+    with locked(path):
+        state = load_sheets_state(path)
+        state[spreadsheet_id] = value
+        save_sheets_state(state, path)
+
+class SheetsWriter(object):
+    """Gathers every pending range for one spreadsheet and sends them in a single values().batchUpdate.
+
+    Also remembers, per tab, the last row written and its date (in cache/sheets_state.json) so the
+    next run doesn't have to read the whole tab back to find the end of it, and keeps a snapshot of
+    every cell it has written (cache/sheets_snapshot.json) so update_rows only sends what changed.
+    Delete the snapshot to force a full rewrite after editing those cells by hand.
+    """
 
-    rangeName = 'Finances!A:N'
-    result = service.spreadsheets().values().get(spreadsheetId=master_sheet, range=rangeName).execute()
-    sheet = result.get('values', [])
+    def __init__(self, service, spreadsheet_id, state_path=SHEETS_STATE_PATH, snapshot_path=SHEETS_SNAPSHOT_PATH):
+        self.service = service
+        self.spreadsheet_id = spreadsheet_id
+        self.state_path = state_path
+        self.snapshot_path = snapshot_path
+        self.state = load_sheets_state(state_path).get(spreadsheet_id, {})
+        self.snapshot = load_sheets_state(snapshot_path).get(spreadsheet_id, {})
+        self.pending = []
+        self.staged = []
 
+    def add(self, range_name, values):
+        self.pending.append({'range': range_name, 'values': values})
+
+    def update_rows(self, tab, start_row, rows):
+        """Queues only the cells of rows (written from sheet row start_row down) that differ from the snapshot"""
+        tab_snapshot = self.snapshot.get(tab, {})
+        old_rows = [tab_snapshot.get(str(start_row + offset)) for offset in range(len(rows))]
+        for range_name, values in diff_rows(tab, start_row, old_rows, rows):
+            self.add(range_name, values)
+        self.staged.append((tab, start_row, rows))
+
+    def remember(self, tab, row, row_date):
+        self.state[tab] = {'last_row': row, 'last_date': row_date}
+
+    def read(self, range_name):
+        request = self.service.spreadsheets().values().get(spreadsheetId=self.spreadsheet_id, range=range_name)
+        result = execute_request('sheets', 'values.get', request)
+        return result.get('values', [])
+
+    def flush(self):
+        result = None
+        if self.pending:
+            print("Writing %d range(s) to sheet" % len(self.pending))
+            body = {'valueInputOption': 'USER_ENTERED', 'data': self.pending}
+            request = self.service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id, body=body)
+            result = execute_request('sheets', 'values.batchUpdate', request)
+            self.pending = []
+        else:
+            print("Sheet is already up to date")
+
+        update_sheets_state(self.state_path, self.spreadsheet_id, self.state)
+
+        if self.staged:
+            for tab, start_row, rows in self.staged:
+                tab_snapshot = self.snapshot.setdefault(tab, {})
+                for offset, row in enumerate(rows):
+                    old_row = tab_snapshot.get(str(start_row + offset)) or []
+                    # None cells were left alone, so they keep whatever was written before
+                    merged = [normalize(value) if normalize(value) is not None
+                              else (old_row[col] if col < len(old_row) else None)
+                              for col, value in enumerate(row)]
+                    tab_snapshot[str(start_row + offset)] = merged + old_row[len(merged):]
+            self.staged = []
+            update_sheets_state(self.snapshot_path, self.spreadsheet_id, self.snapshot)
+        return result
+
+def get_finances_sheet_tail(writer):
+    """Returns (last used row, date in that row) of the Finances tab, or None if the sheet is empty.
+
+    When the last row is known from a previous run only the date column from that row down is read,
+    which also picks up any rows added by hand since.
+    """
+    known = writer.state.get('Finances')
+    if known:
+        column = writer.read('Finances!A%d:A' % known['last_row'])
+        if column and column[0]:
+            return known['last_row'] + len(column) - 1, column[-1][0]
+        print("Remembered Finances row is gone, re-reading the sheet")
+
+    column = writer.read('Finances!A:A')
     print("checking for sheet")
-    if not sheet:
+    if not column:
         print('No data found.')
-    else:
-        i = len(sheet)
-
-        today = datetime.now().strftime("%-m/%-d/%Y")
-        if today == sheet[i-1][0]:
-            print("Overwriting today's row with new data")
-            i-=1
-
-        values = [
-            [
-                today,
-                findata[SHEET_COLS[0]],
-                findata[SHEET_COLS[1]],
-                findata[SHEET_COLS[2]],
-                findata[SHEET_COLS[3]],
-                None,
-                findata[SHEET_COLS[4]],
-                None,
-                findata[SHEET_COLS[5]],
-                findata[SHEET_COLS[6]],
-                None,
-                None,
-                findata[SHEET_COLS[7]],
-                0,
-                None,
-                None,
-                findata[SHEET_COLS[8]],
-                None
-            ]
+        return None
+    return len(column), column[-1][0]
+
+def write_finances_row(writer, findata, tail, sheet_cols=None):
+    """Stages today's row of findata, raising KeyError if any of sheet_cols is missing from it.
+    Returns False if there is no sheet to write to."""
+    if not tail:
+        return False
+    if sheet_cols is None:
+        sheet_cols = SHEET_COLS
+
+    i, last_date = tail
+    today = datetime.now().strftime("%-m/%-d/%Y")
+    if today == last_date:
+        print("Overwriting today's row with new data")
+        i-=1
+
+    values = [
+        [
+            today,
+            findata[sheet_cols[0]],
+            findata[sheet_cols[1]],
+            findata[sheet_cols[2]],
+            findata[sheet_cols[3]],
+            None,
+            findata[sheet_cols[4]],
+            None,
+            findata[sheet_cols[5]],
+            findata[sheet_cols[6]],
+            None,
+            None,
+            findata[sheet_cols[7]],
+            0,
+            None,
+            None,
+            findata[sheet_cols[8]],
+            None
         ]
-        body = {u'values':values}
-        range_name = 'Finances!A%d' % (i+1) # i has to be +1 because sheets counts from 1, not 0
-        result = service.spreadsheets().values().update(spreadsheetId=master_sheet, range=range_name, valueInputOption='USER_ENTERED', body=body).execute()
+    ]
+    writer.update_rows('Finances', i+1, values) # i has to be +1 because sheets counts from 1, not 0
+    writer.remember('Finances', i+1, today)
+    return True
 
-def update_expenses_sheet(master_sheet, categories, transactions):
-    print("Updating expenses sheet")
-    creds = get_credentials(app='sheets', scopes='https://www.googleapis.com/auth/spreadsheets', app_name='Google Sheets API Python Quickstart')
-    discoveryUrl = ('https://sheets.googleapis.com/$discovery/rest?version=v4')
-    service = discovery.build('sheets', 'v4', http=creds.authorize(Http()), discoveryServiceUrl=discoveryUrl)
+def update_finances_sheet(master_sheet, findata, writer=None, sheet_cols=None):
+    """writer: optional SheetsWriter to use instead of one over the real Sheets service"""
+    print_findata_values(findata)
+    print("Updating finances sheet")
+    writer = writer or SheetsWriter(get_sheets_service(), master_sheet)
+    tail = get_finances_sheet_tail(writer)
+    write_finances_row(writer, findata, tail, sheet_cols)
+    writer.flush()
+
+def write_expenses_rows(writer, categories, transactions):
+    """transactions is either a dict of day -> {category -> amount} or an ExpenseMatrix, whose rows
+    are taken straight from the matrix (categories may then be None to use all of its columns)"""
+    if categories is None:
+        categories = transactions.categories
     headers = [ category.title() for category in categories ]
     headers.insert(0, 'Date')
-    values = [
-            headers
-        ]
-    body = {u'values':values}
-    range_name = 'Expenses!A1'
-    result = service.spreadsheets().values().update(spreadsheetId=master_sheet, range=range_name, valueInputOption='USER_ENTERED', body=body).execute()
+    writer.update_rows('Expenses', 1, [headers])
 
     i=2
 
-    values = []
-    for day in transactions:
-        row = [transactions[day][cat] for cat in categories]
-        row.insert(0, day)
-        values.append(row)
-    body = {u'values':values}
-    range_name = 'Expenses!A%d' % i
-    result = service.spreadsheets().values().update(spreadsheetId=master_sheet, range=range_name, valueInputOption='USER_ENTERED', body=body).execute()
-    i+=1
+    if hasattr(transactions, 'rows'):
+        values = list(transactions.rows(categories))
+    else:
+        values = []
+        for day in transactions:
+            row = [transactions[day][cat] for cat in categories]
+            row.insert(0, day)
+            values.append(row)
+    writer.update_rows('Expenses', i, values)
+
+def update_expenses_sheet(master_sheet, categories, transactions, writer=None):
+    print("Updating expenses sheet")
+    writer = writer or SheetsWriter(get_sheets_service(), master_sheet)
+    write_expenses_rows(writer, categories, transactions)
+    writer.flush()
@@ -1,25 +1,74 @@
-try:
-    import pandas as pd
-except ImportError:
-    pd = None
-
-try:
-    from StringIO import StringIO  # Python 2
-except ImportError:
-    from io import BytesIO as StringIO  # Python 3
+# numpy/pandas are imported by assert_pd() on first use; most runs only need
+# the accounts and never pay for them
+np = None
+pd = None
 
 import re
+import itertools
 import json
+import random
 import requests
-from datetime import datetime
-from .getwebdriver import get_mint_page
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from datetime import date, datetime, timedelta
+from .categoryindex import CategoryIndex, CATEGORY_INDEX_PATH, CATEGORY_INDEX_TTL
+from .metrics import metrics
 
 MINT_ROOT_URL = 'https://mint.intuit.com'
 MINT_ACCOUNTS_URL = 'https://accounts.intuit.com'
 
 JSON_HEADER = {'accept': 'application/json'}
+HTTP_POOL_SIZE = 10
+AUTH_FAILURE_STATUS = (401, 403)
 IGNORE_FLOAT_REGEX = re.compile(r"[$,%]")
 
+TRANSACTION_PAGES_IN_FLIGHT = 4  # getJsonData.xevent pages requested ahead of the one being read
+CSV_DOWNLOAD_BLOCK = 64 * 1024  # bytes per read off the transactionDownload response
+CSV_SPOOL_SIZE = 8 * 1024 * 1024  # downloads bigger than this spool to a temp file on disk
+# float32 keeps cents exact after rounding for amounts below ~$160k. Merchants, categories and accounts
+# repeat across a history, so their columns are parsed straight into categoricals (Category's categories
+# are lowercased after the parse) and each distinct string is only held once
+CSV_DTYPES = {
+    'Description': 'category',
+    'Original Description': 'category',
+    'Amount': 'float32',
+    'Transaction Type': 'category',
+    'Category': 'category',
+    'Account Name': 'category',
+    'Labels': object,
+    'Notes': object,
+}
+CSV_COLUMNS = ['Date'] + list(CSV_DTYPES)
+
+# lib/dedupe: most days apart two copies of a transaction can be (more also catches a daily coffee),
+# and the columns that must match, in the JSON frame and the parsed CSV
+DUPLICATE_WINDOW_DAYS = 0
+JSON_DUPLICATE_COLUMNS = ['account', 'amount', 'merchant']
+CSV_DUPLICATE_COLUMNS = ['account_name', 'transaction_type', 'amount', 'description']
+
+REFRESH_TIMEOUT = 180  # seconds to wait for every institution before giving up on the rest
+REFRESH_POLL_DELAY = 2.0  # seconds between account polls, reset whenever an institution finishes
+REFRESH_POLL_MAX_DELAY = 20.0  # the delay grows by REFRESH_POLL_BACKOFF per idle poll up to this
+REFRESH_POLL_BACKOFF = 1.5
+
+ACCOUNT_TYPES = [
+    'BANK',
+    'CREDIT',
+    'INVESTMENT',
+    'LOAN',
+    'MORTGAGE',
+    'OTHER_PROPERTY',
+    'REAL_ESTATE',
+    'VEHICLE',
+    'UNCLASSIFIED'
+]
+
+# account types whose balances are owed rather than owned, subtracted from net worth
+INVERTED_ACCOUNT_TYPES = frozenset(['loan', 'loans', 'credit'])
+
 DATE_FIELDS = [
     'addAccountDate',
     'closeDate',
@@ -28,28 +77,67 @@ DATE_FIELDS = [
 ]
 
 def assert_pd():
-    # Common function to check if pd is installed
-    if not pd:
+    # Common function to import pd on first use, or fail if it isn't installed.
+    # Returns (np, pd) for modules that share it instead of importing pandas eagerly
+    global np, pd
+    if pd:
+        return np, pd
+    try:
+        import numpy as np
+        import pandas as pd
+    except ImportError:
         raise ImportError(
             'transactions data requires pandas; '
             'please pip install pandas'
         )
+    return np, pd
 
 class MintException(Exception):
     pass
 
+class MintAuthError(MintException):
+    """The session is no longer logged in; logging in again should fix it"""
+    pass
+
 class Mint():
     request_id = 42  # magic number? random number?
+    root_url = MINT_ROOT_URL
     token = None
     driver = None
-
-    def __init__(self, email=None, password=None):
+    session = None  # pooled requests.Session, used instead of the driver once logged in without one
+    refresh_timeout = REFRESH_TIMEOUT
+    refresh_poll_delay = REFRESH_POLL_DELAY
+    refresh_poll_max_delay = REFRESH_POLL_MAX_DELAY
+    duplicate_window_days = DUPLICATE_WINDOW_DAYS
+
+    def __init__(self, email=None, password=None, session_store=None, handoff=False,
+                 root_url=None):
+        """
+        Args:
+          session_store: optional SessionStore to save/restore the login between runs
+          handoff: quit Chrome right after login and send every API call over a
+            pooled keep-alive requests.Session instead of the driver
+          root_url: where the Mint API calls go instead of MINT_ROOT_URL, e.g.
+            a local stand-in server
+        """
+        if root_url:
+            self.root_url = root_url
+        self.email = email
+        self.session_store = session_store
+        self.handoff = handoff
         if email and password:
             self.login_and_get_token(email, password)
 
     @classmethod
-    def create(cls, email, password):
-        return Mint(email, password)
+    def create(cls, email, password, session_store=None, handoff=False,
+               root_url=None):
+        return Mint(email, password, session_store=session_store,
+                    handoff=handoff, root_url=root_url)
+
+    def release_driver(self):
+        print("Quitting webdriver")
+        self.driver.quit()
+        self.driver = None
 
     @classmethod
     def get_rnd(cls):  # {{{
@@ -57,20 +145,37 @@ class Mint():
                 str(random.randrange(999)).zfill(3))
 
     def close(self):
-        """Logs out and quits the current web driver/selenium session."""
+        """Logs out and quits the current web driver/selenium session.
+
+        When a session_store is in use the session is saved instead of logged out,
+        so the next run can pick it up without going through the browser.
+        """
+        if self.session_store and self.token and (self.driver or self.session):
+            self.save_session()
+
+        if self.session:
+            self.session.close()
+            self.session = None
+
         if not self.driver:
             return
 
-        try:
-            print("Logging out")
-            self.driver.implicitly_wait(1)
-            self.driver.find_element_by_id('link-logout').click()
-        except:
-            pass
+        if not self.session_store:
+            try:
+                print("Logging out")
+                self.driver.implicitly_wait(1)
+                self.driver.find_element_by_id('link-logout').click()
+            except:
+                pass
 
-        print("Quitting webdriver")
-        self.driver.quit()
-        self.driver = None
+        self.release_driver()
+
+    def discard_session(self):
+        """Forgets the saved session once Mint has rejected it, so close()
+        doesn't save the dead cookies back for the next login to probe."""
+        if self.session_store:
+            self.session_store.clear(self.email)
+        self.token = None
 
     def request_and_check(self, url, method='get',
                           expected_content_type=None, **kwargs):
@@ -87,7 +192,7 @@ class Mint():
           RuntimeError if status_code does not match.
         """
         assert method in ['get', 'post']
-        result = self.driver.request(method, url, **kwargs)
+        result = self.request(method, url, **kwargs)
         if result.status_code != requests.codes.ok:
             raise RuntimeError('Error requesting %r, status = %d' %
                                (url, result.status_code))
@@ -99,18 +204,116 @@ class Mint():
                     (url, content_type, expected_content_type))
         return result
 
+    def request(self, method, url, **kwargs):
+        """Sends a request through the driver, or the pooled session once
+        there is no driver.
+
+        Raises:
+          MintAuthError if Mint answers with 401/403 or bounces the request
+          to the Intuit login page.
+        """
+        endpoint = url.split('?', 1)[0].rsplit('/', 1)[-1]
+        start = time.time()
+        try:
+            if self.driver:
+                result = self.driver.request(method, url, **kwargs)
+            else:
+                result = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            metrics.count('errors', service='mint', kind=type(e).__name__)
+            raise
+        # a streamed body hasn't been read yet, count what the server said it is sending
+        nbytes = (int(result.headers.get('content-length') or 0) if kwargs.get('stream')
+                  else len(result.content))
+        metrics.record_request('mint', endpoint, result.status_code, nbytes, time.time() - start)
+        if (result.status_code in AUTH_FAILURE_STATUS or
+                result.url.startswith(MINT_ACCOUNTS_URL)):
+            metrics.count('errors', service='mint', kind='auth')
+            raise MintAuthError('Not logged in requesting %r, status = %d' %
+                                (url, result.status_code))
+        return result
+
     def get(self, url, **kwargs):
-        return self.driver.request('GET', url, **kwargs)
+        return self.request('GET', url, **kwargs)
 
     def post(self, url, **kwargs):
-        return self.driver.request('POST', url, **kwargs)
+        return self.request('POST', url, **kwargs)
 
     def login_and_get_token(self, email, password):
-        if self.token and self.driver:
+        if self.token and (self.driver or self.session):
+            return
+
+        if self.session_store and self.restore_session():
             return
 
+        # selenium only loads when there is no session to reuse
+        from .getwebdriver import get_mint_page
         self.driver = get_mint_page(email, password)
         self.token = self.get_token()
+        if self.handoff:
+            self.handoff_to_session()
+        if self.session_store:
+            self.save_session()
+
+    def handoff_to_session(self):
+        """Copies the logged in driver's cookies into a pooled requests.Session and quits Chrome"""
+        self.session = make_session(
+            self.driver.get_cookies(),
+            user_agent=self.driver.execute_script('return navigator.userAgent'))
+        print("Continuing over pooled HTTP")
+        self.release_driver()
+
+    def restore_session(self):
+        """Loads saved cookies and token into a requests.Session and probes them.
+
+        Returns True if the saved session is still logged in.
+        """
+        saved = self.session_store.load(self.email)
+        if not saved:
+            return False
+
+        session = make_session(saved['cookies'], user_agent=saved.get('user_agent'))
+        self.session = session
+        self.token = saved['token']
+
+        if self.probe_session():
+            print("Mint: reusing cached session")
+            return True
+
+        print("Mint: cached session has expired, logging in through the browser")
+        self.session_store.clear(self.email)
+        session.close()
+        self.session = None
+        self.token = None
+        return False
+
+    def probe_session(self):
+        """Cheap authenticated request, an expired session gets redirected to the (html) login page"""
+        try:
+            self.request_and_check(
+                '{}/userStatus.xevent'.format(self.root_url),
+                params={'rnd': Mint.get_rnd()},
+                headers=JSON_HEADER,
+                expected_content_type='text/json|application/json')
+        except (RuntimeError, MintException, requests.RequestException):
+            return False
+        return True
+
+    def save_session(self):
+        if self.driver:
+            cookies = self.driver.get_cookies()
+            user_agent = self.driver.execute_script('return navigator.userAgent')
+        else:
+            cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path}
+                       for c in self.session.cookies]
+            user_agent = self.session.headers.get('User-Agent')
+        self.session_store.save(self.email, {
+            'cookies': [{'name': c['name'], 'value': c['value'],
+                         'domain': c.get('domain'), 'path': c.get('path', '/')}
+                        for c in cookies],
+            'token': self.token,
+            'user_agent': user_agent,
+        })
 
     def get_token(self):
         value_json = self.driver.find_element_by_name(
@@ -122,48 +325,21 @@ class Mint():
         self.request_id += 1
         return str(req_id)
 
-    def get_accounts(self, get_detail=False):  # {{{
-        # Issue service request.
-        req_id = self.get_request_id_str()
-
-        input = {
-            'args': {
-                'types': [
-                    'BANK',
-                    'CREDIT',
-                    'INVESTMENT',
-                    'LOAN',
-                    'MORTGAGE',
-                    'OTHER_PROPERTY',
-                    'REAL_ESTATE',
-                    'VEHICLE',
-                    'UNCLASSIFIED'
-                ]
-            },
-            'id': req_id,
-            'service': 'MintAccountService',
-            'task': 'getAccountsSorted'
-            # 'task': 'getAccountsSortedByBalanceDescending'
-        }
+    def batch(self):
+        """Returns a MintBatch, which queues service tasks and sends them
+        to bundledServiceController.xevent in a single request:
 
-        data = {'input': json.dumps([input])}
-        account_data_url = (
-            '{}/bundledServiceController.xevent?legacy=false&token={}'.format(
-                MINT_ROOT_URL, self.token))
-        response = self.post(
-            account_data_url,
-            data=data,
-            headers=JSON_HEADER
-        ).text
-        if req_id not in response:
-            raise MintException('Could not parse account data: ' + response)
-
-        # Parse the request
-        response = json.loads(response)
-        accounts = response['response'][req_id]['response']
-
-        for account in accounts:
-            convert_account_dates_to_datetime(account)
+            with mint.batch() as batch:
+                accounts = batch.get_accounts()
+                categories = batch.get_categories()
+            accounts.result()
+        """
+        return MintBatch(self)
+
+    def get_accounts(self, get_detail=False):  # {{{
+        with self.batch() as batch:
+            call = batch.get_accounts()
+        accounts = call.result()
 
         if get_detail:
             accounts = self.populate_extended_account_detail(accounts)
@@ -171,24 +347,9 @@ class Mint():
         return accounts
 
     def set_user_property(self, name, value):
-        url = (
-            '{}/bundledServiceController.xevent?legacy=false&token={}'.format(
-                MINT_ROOT_URL, self.token))
-        req_id = self.get_request_id_str()
-        result = self.post(
-            url,
-            data={'input': json.dumps([{'args': {'propertyName': name,
-                                                 'propertyValue': value},
-                                        'service': 'MintUserService',
-                                        'task': 'setUserProperty',
-                                        'id': req_id}])},
-            headers=JSON_HEADER)
-        if result.status_code != 200:
-            raise MintException('Received HTTP error %d' % result.status_code)
-        response = result.text
-        if req_id not in response:
-            raise MintException(
-                'Could not parse response to set_user_property')
+        with self.batch() as batch:
+            call = batch.set_user_property(name, value)
+        call.result()
 
     def get_transactions_json(self, include_investment=False,
                               skip_duplicates=False, start_date=None):
@@ -197,57 +358,143 @@ class Mint():
         CSV data, such as whether the transaction is pending or completed, but
         leaves off the year for current year transactions.
 
-        Warning: In order to reliably include or exclude duplicates, it is
-        necessary to change the user account property 'hide_duplicates' to the
-        appropriate value.  This affects what is displayed in the web
-        interface.  Note that the CSV transactions never exclude duplicates.
+        skip_duplicates drops the transactions Mint flags as duplicates and
+        the ones lib/dedupe finds to be copies of another (same account,
+        amount and merchant within duplicate_window_days), in one pass once
+        every page is in.  This is done locally, the account's
+        hide_duplicates setting in the web interface is left alone.
         """
 
-        # Warning: This is a global property for the user that we are changing.
-        self.set_user_property(
-            'hide_duplicates', 'T' if skip_duplicates else 'F')
-
         # Converts the start date into datetime format - must be mm/dd/yy
         try:
             start_date = datetime.strptime(start_date, '%m/%d/%y')
         except:
             start_date = None
         all_txns = []
-        offset = 0
-        # Mint only returns some of the transactions at once.  To get all of
-        # them, we have to keep asking for more until we reach the end.
-        while 1:
-            # Specifying accountId=0 causes Mint to return investment
-            # transactions as well.  Otherwise they are skipped by
-            # default.
-            url = (
-                MINT_ROOT_URL +
-                '/getJsonData.xevent?' +
-                'queryNew=&offset={offset}&comparableType=8&' +
-                'rnd={rnd}&{query_options}').format(
-                    offset=offset,
-                    rnd=Mint.get_rnd(),
-                    query_options=(
-                        'accountId=0&task=transactions' if include_investment
-                        else 'task=transactions,txnfilters&filterType=cash'))
+        for txns in self.iter_transaction_pages(include_investment, start_date):
+            all_txns.extend(txns)
+        if skip_duplicates:
+            from .dedupe import DuplicateIndex
+            all_txns = drop_duplicate_transactions(all_txns, DuplicateIndex(self.duplicate_window_days))
+        return all_txns
+
+    def iter_transaction_pages(self, include_investment=False, start_date=None,
+                               in_flight=TRANSACTION_PAGES_IN_FLIGHT):
+        """Yields pages of raw JSON transactions, newest first, as they arrive.
+
+        Mint only returns some of the transactions at once, so the first page
+        is fetched on its own to learn the page size, then up to in_flight
+        pages are kept requested ahead over the pooled session.  Paging stops
+        at the first short page; the requests already sent past the end come
+        back empty and are dropped.
+
+        start_date: datetime; the page that crosses it is cut at its first
+        older transaction, found by binary search since pages are sorted by
+        date, and nothing older is requested.
+        """
+        if self.driver:
+            in_flight = 1  # the driver can't be shared between threads
+        page = self.get_transactions_page(0, include_investment)
+        page_size = len(page)
+        offsets = itertools.count(page_size, page_size)
+        executor = ThreadPoolExecutor(in_flight)
+        pending = deque()
+        try:
+            while page:
+                if start_date is not None:
+                    cut = first_transaction_before(page, start_date)
+                    if cut < len(page):
+                        if cut:
+                            yield page[:cut]
+                        return
+                more = len(page) >= page_size
+                # top up the requests in flight before handing this page over
+                while more and len(pending) < in_flight:
+                    pending.append(executor.submit(
+                        self.get_transactions_page, next(offsets), include_investment))
+                yield page
+                if not more:
+                    return
+                page = pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def get_transactions_page(self, offset, include_investment=False):
+        """Returns one page of raw JSON transactions, starting at offset (newest first)"""
+        # Specifying accountId=0 causes Mint to return investment
+        # transactions as well.  Otherwise they are skipped by
+        # default.
+        url = (
+            self.root_url +
+            '/getJsonData.xevent?' +
+            'queryNew=&offset={offset}&comparableType=8&' +
+            'rnd={rnd}&{query_options}').format(
+                offset=offset,
+                rnd=Mint.get_rnd(),
+                query_options=(
+                    'accountId=0&task=transactions' if include_investment
+                    else 'task=transactions,txnfilters&filterType=cash'))
+        with metrics.span('mint_transactions_page'):
             result = self.request_and_check(
                 url, headers=JSON_HEADER,
                 expected_content_type='text/json|application/json')
-            data = json.loads(result.text)
-            txns = data['set'][0].get('data', [])
+            data = json.loads(result.content)  # straight from the bytes, no decoded copy
+            return data['set'][0].get('data', [])
+
+    def sync_transactions(self, store, include_investment=False,
+                          skip_duplicates=False):
+        """Brings a TransactionStore up to date and returns the transactions
+        that were new or changed since the last sync.
+
+        Pages are fetched newest first, and paging stops at the first page
+        whose transactions are all already stored and unchanged.  If the
+        store still holds pending transactions older than that page, paging
+        continues until it is past the oldest of them; any stored pending
+        transaction that wasn't seen again has since posted (under a new id)
+        or been dropped, and is removed from the store.
+
+        With skip_duplicates, the new or changed transactions are checked for
+        duplicates against each other and the stored ones within
+        duplicate_window_days of them, and the duplicates are left out.  Their
+        ids are remembered in the store's meta table so later syncs skip them.
+        """
+        unseen_pending = store.pending_ids()
+        oldest_pending = store.oldest_pending_date()
+        # duplicates dropped by earlier syncs count as unchanged, so they don't keep paging going
+        dropped = set(store.get_meta('duplicate_ids', [])) if skip_duplicates else set()
+        changed = []
+        offset = 0
+        while 1:
+            txns = self.get_transactions_page(offset, include_investment)
             if not txns:
                 break
-            if start_date:
-                last_dt = json_date_to_datetime(txns[-1]['odate'])
-                if last_dt < start_date:
-                    keep_txns = [
-                        t for t in txns
-                        if json_date_to_datetime(t['odate']) >= start_date]
-                    all_txns.extend(keep_txns)
-                    break
-            all_txns.extend(txns)
+            odates = [json_date_to_datetime(t['odate']) for t in txns]
+            stored = store.get([t['id'] for t in txns])
+            page_changed = [
+                (t, odate) for t, odate in zip(txns, odates)
+                if t['id'] not in dropped and
+                not transaction_unchanged(stored.get(t['id']), t, odate)]
+            changed.extend(page_changed)
+            unseen_pending.difference_update(t['id'] for t in txns)
             offset += len(txns)
-        return all_txns
+            if not page_changed and (
+                    not unseen_pending or odates[-1] < oldest_pending):
+                break
+
+        if skip_duplicates and changed:
+            kept = drop_synced_duplicates(store, changed, unseen_pending, self.duplicate_window_days)
+            kept_ids = set(t['id'] for t, odate in kept)
+            dropped.update(t['id'] for t, odate in changed if t['id'] not in kept_ids)
+            store.set_meta('duplicate_ids', sorted(dropped))
+            changed = kept
+        store.upsert(changed)
+        if unseen_pending:
+            print("Removing %d pending transactions that have since posted" %
+                  len(unseen_pending))
+            store.delete(unseen_pending)
+        return [t for t, odate in changed]
 
     def get_detailed_transactions(self, include_investment=False,
                                   skip_duplicates=False,
@@ -271,16 +518,7 @@ class Mint():
 
         result = self.get_transactions_json(include_investment,
                                             skip_duplicates, start_date)
-        df = pd.DataFrame(result)
-        df['odate'] = df['odate'].apply(json_date_to_datetime)
-
-        if remove_pending:
-            df = df[~df.isPending]
-            df.reset_index(drop=True, inplace=True)
-
-        df.amount = df.apply(reverse_credit_amount, axis=1)
-
-        return df
+        return transactions_to_dataframe(result, remove_pending)
 
     def get_transactions_csv(self, include_investment=False):
         """Returns the raw CSV transaction data as downloaded from Mint.
@@ -288,82 +526,91 @@ class Mint():
         If include_investment == True, also includes transactions that Mint
         classifies as investment-related.  You may find that the investment
         transaction data is not sufficiently detailed to actually be useful,
-        however.
+        however.  The bytes are left as downloaded, duplicates included; use
+        get_transactions(skip_duplicates=True) for the parsed rows without.
         """
 
+        csvfile = BytesIO()
+        self.download_transactions_csv(csvfile, include_investment)
+        return csvfile.getvalue()
+
+    def download_transactions_csv(self, csvfile, include_investment=False):
+        """Streams the CSV transaction download into the file object csvfile
+        a block at a time, without holding the whole body in memory, and
+        returns the number of bytes written."""
         # Specifying accountId=0 causes Mint to return investment
         # transactions as well.  Otherwise they are skipped by
         # default.
         result = self.request_and_check(
-            '{}/transactionDownload.event'.format(MINT_ROOT_URL) +
+            '{}/transactionDownload.event'.format(self.root_url) +
             ('?accountId=0' if include_investment else ''),
-            expected_content_type='text/csv')
-        # print(result.content)
-        # with open("transactions.csv", 'w') as csvfile:
-        #     csvfile.write(result.content)
-        return result.content
+            expected_content_type='text/csv', stream=True)
+        written = 0
+        try:
+            for block in result.iter_content(CSV_DOWNLOAD_BLOCK):
+                csvfile.write(block)
+                written += len(block)
+        finally:
+            result.close()
+        return written
 
     def get_net_worth(self, account_data=None):
         if account_data is None:
             account_data = self.get_accounts()
 
-        # account types in this list will be subtracted
-        invert = set(['loan', 'loans', 'credit'])
         return sum([
-            -a['currentBalance']
-            if a['accountType'] in invert else a['currentBalance']
+            signed_balance(a['currentBalance'], a['accountType'])
             for a in account_data if a['isActive']
         ])
 
-    def get_transactions(self, include_investment=False):
-        """Returns the transaction data as a Pandas DataFrame."""
+    def get_transactions(self, include_investment=False, parquet_path=None,
+                         skip_duplicates=False):
+        """Returns the transaction data as a Pandas DataFrame.
+
+        The CSV download is spooled to a temp file and parsed in one pass
+        with fixed dtypes (float32 amount, categorical category,
+        account_name and transaction_type), so peak memory stays well below
+        parsing the whole body with inferred dtypes. If parquet_path is
+        given the frame is also written there (needs pyarrow or
+        fastparquet).
+
+        The CSV has no duplicate flag or ids; skip_duplicates drops the rows
+        lib/dedupe finds to be copies of another (same account, type, amount
+        and description within duplicate_window_days).
+        """
+        from .dedupe import find_duplicates
         assert_pd()
-        s = StringIO(self.get_transactions_csv(
-            include_investment=include_investment))
-        s.seek(0)
-        df = pd.read_csv(s, parse_dates=['Date'])
-        df.columns = [c.lower().replace(' ', '_') for c in df.columns]
-        df.category = (df.category.str.lower()
-                       .replace('uncategorized', pd.np.nan))
+        with tempfile.SpooledTemporaryFile(max_size=CSV_SPOOL_SIZE) as spool:
+            self.download_transactions_csv(spool, include_investment)
+            spool.seek(0)
+            df = read_transactions_csv(spool)
+        if skip_duplicates and not df.empty:
+            duplicates = find_duplicates(df, 'date', CSV_DUPLICATE_COLUMNS,
+                                         window_days=self.duplicate_window_days)
+            metrics.count('duplicates', int(duplicates.sum()), service='mint', source='csv')
+            df = df[~duplicates].reset_index(drop=True)
+        if parquet_path:
+            df.to_parquet(parquet_path, index=False)
         return df
 
-
     def get_categories(self):  # {{{
-        # Get category metadata.
-        req_id = self.get_request_id_str()
-        data = {
-            'input': json.dumps([{
-                'args': {
-                    'excludedCategories': [],
-                    'sortByPrecedence': False,
-                    'categoryTypeFilter': 'FREE'
-                },
-                'id': req_id,
-                'service': 'MintCategoryService',
-                'task': 'getCategoryTreeDto2'
-            }])
-        }
-
-        cat_url = (
-            '{}/bundledServiceController.xevent?legacy=false&token={}'.format(
-                MINT_ROOT_URL, self.token))
-        response = self.post(cat_url, data=data, headers=JSON_HEADER).text
-        if req_id not in response:
-            raise MintException('Could not parse category data: "' +
-                                response + '"')
-        response = json.loads(response)
-        response = response['response'][req_id]['response']
-
-        # Build category list
-        categories = {}
-        for category in response['allCategories']:
-            categories[category['id']] = category
-
-        return categories
+        with self.batch() as batch:
+            call = batch.get_categories()
+        return call.result()
+
+    def get_category_index(self, path=CATEGORY_INDEX_PATH,
+                           ttl=CATEGORY_INDEX_TTL):
+        """Returns the CategoryIndex saved at path, rebuilding it from
+        get_categories() when it is missing or older than ttl seconds."""
+        index = CategoryIndex.load(path, ttl)
+        if index is None:
+            index = CategoryIndex.from_categories(self.get_categories())
+            index.save(path)
+        return index
 
     def get_budgets(self):  # {{{
         # Get categories
-        categories = self.get_categories()
+        categories = self.get_category_index()
 
         # Issue request for budget utilization
         today = date.today()
@@ -373,13 +620,14 @@ class Mint():
                       '/01/' + str(this_month.year))
         last_year = (str(last_year.month).zfill(2) +
                      '/01/' + str(last_year.year))
-        url = "{}/getBudget.xevent".format(MINT_ROOT_URL)
+        url = "{}/getBudget.xevent".format(self.root_url)
         params = {
             'startDate': last_year,
             'endDate': this_month,
             'rnd': Mint.get_rnd(),
         }
-        response = json.loads(self.get(url, params, headers=JSON_HEADER)).text
+        response = json.loads(
+            self.get(url, params=params, headers=JSON_HEADER).text)
 
         # Make the skeleton return structure
         budgets = {
@@ -394,34 +642,207 @@ class Mint():
         # Fill in the return structure
         for direction in budgets.keys():
             for budget in budgets[direction]:
-                budget['cat'] = self.get_category_from_id(
-                    budget['cat'],
-                    categories
-                )
+                budget['cat'] = categories.name(budget['cat'])
 
         return budgets
 
     def get_category_from_id(self, cid, categories):
-        if cid == 0:
-            return 'Uncategorized'
-
-        for i in categories:
-            if categories[i]['id'] == cid:
-                return categories[i]['name']
-
-            if 'children' in categories[i]:
-                for j in categories[i]['children']:
-                    if categories[i][j]['id'] == cid:
-                        return categories[i][j]['name']
-
-        return 'Unknown'
+        """categories may be a CategoryIndex or get_categories() output;
+        prefer passing an index when resolving more than one id."""
+        if not isinstance(categories, CategoryIndex):
+            categories = CategoryIndex.from_categories(categories)
+        return categories.name(cid)
 
     def initiate_account_refresh(self):
         self.post(
-            '{}/refreshFILogins.xevent'.format(MINT_ROOT_URL),
+            '{}/refreshFILogins.xevent'.format(self.root_url),
             data={'token': self.token},
             headers=JSON_HEADER)
 
+    def iter_refreshed_accounts(self, timeout=None):
+        """Starts an account refresh and yields each account as soon as its
+        institution has finished, i.e. once its fiLastUpdated/lastUpdated has
+        moved past what it was before the refresh.
+
+        Comparing against each account's own timestamp, rather than the local
+        clock, keeps this right however far Mint's clock is from ours.
+        Inactive accounts never refresh and are yielded straight away.
+        Accounts still waiting after `timeout` seconds are yielded with their
+        last polled values. Every account gets a 'refreshed' flag.
+        """
+        timeout = self.refresh_timeout if timeout is None else timeout
+        before = dict((account['id'], last_updated(account)) for account in self.get_accounts())
+        started = time.time()
+        self.initiate_account_refresh()
+        deadline = started + timeout
+        delay = self.refresh_poll_delay
+        done = set()
+        accounts = []
+
+        while True:
+            accounts = self.get_accounts()
+            metrics.count('refresh_polls', service='mint')
+            finished = 0
+            for account in accounts:
+                if account['id'] in done:
+                    continue
+                previous = before.get(account['id'])
+                updated = last_updated(account)
+                if not account.get('isActive', True) or account['id'] not in before or (
+                        updated is not None and (previous is None or updated > previous)):
+                    done.add(account['id'])
+                    finished += 1
+                    account['refreshed'] = True
+                    metrics.record_span('mint_account_refresh', time.time() - started)
+                    yield account
+            if len(done) >= len(accounts):
+                return
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            # back off while nothing changes, poll quickly again once banks start finishing
+            delay = self.refresh_poll_delay if finished else min(delay * REFRESH_POLL_BACKOFF, self.refresh_poll_max_delay)
+            time.sleep(min(delay, remaining))
+
+        stale = [account for account in accounts if account['id'] not in done]
+        print("Refresh timed out after %ds, using last known values for %s" % (
+            timeout, ', '.join('%s: %s' % (a.get('fiName'), a.get('accountName')) for a in stale)))
+        metrics.count('errors', len(stale), service='mint', kind='refresh_timeout')
+        for account in stale:
+            account['refreshed'] = False
+            yield account
+
+
+class BatchedCall(object):
+    """Handle for one task queued on a MintBatch, resolved once the batch is sent"""
+
+    def __init__(self, req_id, description, parse=None):
+        self.req_id = req_id
+        self.description = description
+        self.parse = parse
+        self.sent = False
+        self.value = None
+        self.error = None
+
+    def resolve(self, response, raw):
+        self.sent = True
+        if self.req_id not in response:
+            self.error = MintException(
+                'Could not parse %s: "%s"' % (self.description, raw))
+            return
+        value = response[self.req_id]['response']
+        self.value = self.parse(value) if self.parse else value
+
+    def result(self):
+        if not self.sent:
+            raise MintException('%s requested before its batch was sent' %
+                                self.description)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class MintBatch(object):
+    """Collects service tasks, each with its own request id, and sends them
+    to bundledServiceController.xevent as one JSON array.  Sent when the
+    with block exits cleanly, or explicitly with send()."""
+
+    def __init__(self, mint):
+        self.mint = mint
+        self.tasks = []
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def add(self, service, task, args, description, parse=None):
+        req_id = self.mint.get_request_id_str()
+        self.tasks.append({
+            'args': args,
+            'id': req_id,
+            'service': service,
+            'task': task,
+        })
+        call = BatchedCall(req_id, description, parse)
+        self.calls.append(call)
+        return call
+
+    def get_accounts(self):
+        return self.add(
+            'MintAccountService', 'getAccountsSorted',
+            # 'getAccountsSortedByBalanceDescending'
+            {'types': ACCOUNT_TYPES}, 'account data', parse=parse_accounts)
+
+    def get_categories(self):
+        return self.add(
+            'MintCategoryService', 'getCategoryTreeDto2',
+            {
+                'excludedCategories': [],
+                'sortByPrecedence': False,
+                'categoryTypeFilter': 'FREE'
+            },
+            'category data', parse=parse_categories)
+
+    def set_user_property(self, name, value):
+        return self.add(
+            'MintUserService', 'setUserProperty',
+            {'propertyName': name, 'propertyValue': value},
+            'response to set_user_property')
+
+    def send(self):
+        if not self.tasks:
+            return
+        url = (
+            '{}/bundledServiceController.xevent?legacy=false&token={}'.format(
+                self.mint.root_url, self.mint.token))
+        result = self.mint.post(
+            url,
+            data={'input': json.dumps(self.tasks)},
+            headers=JSON_HEADER)
+        if result.status_code != 200:
+            raise MintException('Received HTTP error %d' % result.status_code)
+        try:
+            response = json.loads(result.text)['response']
+        except (ValueError, KeyError):
+            response = {}
+        for call in self.calls:
+            call.resolve(response, result.text)
+        self.tasks = []
+        self.calls = []
+
+
+def parse_accounts(accounts):
+    for account in accounts:
+        convert_account_dates_to_datetime(account)
+    return accounts
+
+
+def parse_categories(response):
+    # Build category list
+    categories = {}
+    for category in response['allCategories']:
+        categories[category['id']] = category
+    return categories
+
+
+def make_session(cookies, user_agent=None, pool_size=HTTP_POOL_SIZE):
+    """Builds a keep-alive requests.Session with a connection pool from selenium-style cookie dicts"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if user_agent:
+        session.headers['User-Agent'] = user_agent
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'],
+                            domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return session
+
 
 def get_accounts(email, password, get_detail=False):
     mint = Mint.create(email, password)
@@ -462,6 +883,13 @@ def initiate_account_refresh(email, password):
     return mint.initiate_account_refresh()
 
 
+def last_updated(account):
+    """The later of an account's fiLastUpdated and lastUpdated, as converted by
+    convert_account_dates_to_datetime, or None if it has neither"""
+    dates = [account[field] for field in ('fiLastUpdatedInDate', 'lastUpdatedInDate') if account.get(field)]
+    return max(dates) if dates else None
+
+
 def convert_account_dates_to_datetime(account):
     for df in DATE_FIELDS:
         if df in account:
@@ -476,7 +904,9 @@ def convert_account_dates_to_datetime(account):
 
 
 def json_date_to_datetime(dateraw):
-    cy = datetime.isocalendar(date.today())[0]
+    # 'Mon DD' dates are this calendar year, the same rule as json_dates_to_datetimes
+    # (not the ISO year, which differs in the last/first days of December/January)
+    cy = date.today().year
     try:
         newdate = datetime.strptime(dateraw + str(cy), '%b %d%Y')
     except:
@@ -484,6 +914,151 @@ def json_date_to_datetime(dateraw):
     return newdate
 
 
+def first_transaction_before(txns, start_date):
+    """Index of the first transaction older than start_date in a page sorted
+    newest first, or len(txns) if there is none"""
+    lo, hi = 0, len(txns)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if json_date_to_datetime(txns[mid]['odate']) < start_date:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def json_duplicate_keys(txns, odates=None):
+    """dedupe keys of raw JSON transactions, by id.  odates are their parsed
+    dates when already known, e.g. from the TransactionStore, since the raw
+    'Mon DD' dates of a past year would parse as this year's."""
+    from .dedupe import duplicate_keys
+    assert_pd()
+    df = pd.DataFrame(txns, columns=['id', 'odate', 'amount', 'isDebit', 'account', 'merchant'])
+    dates = pd.to_datetime(pd.Series(odates)) if odates is not None else json_dates_to_datetimes(df['odate'])
+    keyed = pd.DataFrame({
+        'date': dates.values,
+        'account': df['account'].values,
+        'amount': reverse_credit_amounts(df),
+        'merchant': df['merchant'].values,
+    })
+    return duplicate_keys(keyed, 'date', JSON_DUPLICATE_COLUMNS, ids=df['id'].values)
+
+
+def drop_duplicate_transactions(txns, index, odates=None):
+    """Drops the raw JSON transactions Mint flags as duplicates or that
+    duplicate one already in the DuplicateIndex, adding the rest to it.
+    Returns the kept transactions, or (transaction, odate) pairs if odates
+    were given."""
+    if not txns:
+        return txns
+    duplicates = index.mark(json_duplicate_keys(txns, odates))
+    duplicates |= np.array([bool(t.get('isDuplicate')) for t in txns])
+    metrics.count('duplicates', int(duplicates.sum()), service='mint', source='json')
+    if odates is None:
+        return [t for t, duplicate in zip(txns, duplicates) if not duplicate]
+    return [(t, odate) for t, odate, duplicate in zip(txns, odates, duplicates) if not duplicate]
+
+
+def drop_synced_duplicates(store, changed, removed_ids, window_days=DUPLICATE_WINDOW_DAYS):
+    """Drops the (transaction, odate) pairs that duplicate each other or a
+    stored transaction dated within window_days of them.  Only that slice of
+    the store is read; removed_ids (e.g. pending ones that have since posted)
+    and the changed transactions' own stored versions are left out of it."""
+    from .dedupe import DuplicateIndex
+    odates = [odate for t, odate in changed]
+    window = timedelta(days=window_days)
+    skip = set(removed_ids) | set(t['id'] for t, odate in changed)
+    stored = [(payload, odate) for txn_id, (payload, odate) in
+              store.between(min(odates) - window, max(odates) + window).items()
+              if txn_id not in skip]
+    index = DuplicateIndex(window_days)
+    if stored:
+        index.add(json_duplicate_keys([p for p, odate in stored], [odate for p, odate in stored]))
+    return drop_duplicate_transactions([t for t, odate in changed], index, odates)
+
+
+def transaction_unchanged(stored, txn, odate):
+    """Compares a stored (payload, odate) pair against a freshly fetched
+    transaction.  The raw date fields are left out of the comparison since
+    Mint switches them from 'Mon DD' to 'mm/dd/yy' at the turn of the year."""
+    if stored is None:
+        return False
+    payload, stored_odate = stored
+    ignored = ('date', 'odate')
+    return (stored_odate == odate and
+            dict((k, v) for k, v in payload.items() if k not in ignored) ==
+            dict((k, v) for k, v in txn.items() if k not in ignored))
+
+
+def json_dates_to_datetimes(odates):
+    """Vectorized json_date_to_datetime over a Series of Mint 'odate' strings.
+
+    Current year dates look like 'Mon DD' and older ones like 'mm/dd/yy', so
+    each format is parsed in bulk on its own slice of the Series.
+    """
+    prior_year = odates.str.contains('/', regex=False).values
+    parsed = pd.Series(pd.NaT, index=odates.index, dtype='datetime64[ns]')
+    parsed[~prior_year] = pd.to_datetime(
+        odates[~prior_year] + ' ' + str(date.today().year), format='%b %d %Y')
+    parsed[prior_year] = pd.to_datetime(odates[prior_year], format='%m/%d/%y')
+    return parsed
+
+
+def reverse_credit_amounts(df):
+    """Vectorized reverse_credit_amount: parses '$1,234.56' strings and
+    negates the amounts that aren't debits."""
+    amount = (df['amount'].str.slice(1)
+              .str.replace(',', '', regex=False)
+              .astype(np.float64))
+    return np.where(df['isDebit'].values, amount.values, -amount.values)
+
+
+def transactions_to_dataframe(txns, remove_pending=True):
+    """Builds the get_detailed_transactions DataFrame from raw JSON transactions"""
+    assert_pd()
+
+    df = pd.DataFrame(txns)
+    if df.empty:
+        return df
+    if remove_pending:
+        df = df[~df.isPending]
+        df.reset_index(drop=True, inplace=True)
+
+    df['odate'] = json_dates_to_datetimes(df['odate'])
+    df['amount'] = reverse_credit_amounts(df)
+    return df
+
+
+def read_transactions_csv(csvfile):
+    """Parses a Mint transactions CSV file object in a single typed pass into
+    a DataFrame with lowercased, snake_case column names."""
+    assert_pd()
+    df = pd.read_csv(csvfile, usecols=CSV_COLUMNS, dtype=CSV_DTYPES,
+                     parse_dates=['Date'])
+    df.columns = [c.lower().replace(' ', '_') for c in df.columns]
+    df['category'] = lowercase_categories(df['category'], drop='uncategorized')
+    return df
+
+
+def lowercase_categories(series, drop=None):
+    """Lowercases a categorical's categories (merging ones that only differ
+    in case) by remapping its codes, without materializing the strings, and
+    makes drop missing"""
+    lowered = series.cat.categories.str.lower()
+    categories = pd.Index(lowered.unique())
+    if drop is not None:
+        categories = categories[categories != drop]
+    remap = np.append(categories.get_indexer(lowered), -1)  # code -1 (missing) stays missing
+    return pd.Series(pd.Categorical.from_codes(remap[series.cat.codes.values], categories),
+                     index=series.index, name=series.name)
+
+
+def signed_balance(balance, account_type):
+    """Balance as it counts towards net worth, negative for loan and credit
+    accounts"""
+    return -balance if account_type in INVERTED_ACCOUNT_TYPES else balance
+
+
 def reverse_credit_amount(row):
     amount = float(row['amount'][1:].replace(',', ''))
     return amount if row['isDebit'] else -amount
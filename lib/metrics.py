@@ -0,0 +1,186 @@
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from . import CACHE_DIR
+from .atomicfile import write_atomic
+
+METRICS_LOG_PATH = os.path.join(CACHE_DIR, 'metrics.jsonl')
+TEXTFILE_DIR_ENV = 'FINTRACKER_TEXTFILE_DIR'  # e.g. node_exporter's --collector.textfile.directory
+TEXTFILE_DIR = os.path.join(CACHE_DIR, 'metrics')
+
+"""
+Run instrumentation: timed spans per stage, per-endpoint request counts/bytes/time, retry and error
+counters and sampled peaks, collected in one process-wide registry and exported after each run as a JSON line
+(cache/metrics.jsonl) and a Prometheus textfile (cache/metrics/<run>.prom, or $FINTRACKER_TEXTFILE_DIR).
+
+    with metrics.span('mint_accounts'):
+        ...
+    metrics.record_request('mint', 'getJsonData.xevent', 200, len(result.content), elapsed)
+    metrics.count('retries', service='robinhood')
+    metrics.record_peak('browser_rss_bytes', rss, stage='logged_in')
+    metrics.export(ok=True)
+
+Spans with the same name are aggregated (calls, total and max seconds, errors), so per-page spans
+don't grow without bound. Everything is reset at the start of each run.
+"""
+
+class Metrics(object):
+
+    def __init__(self, run_name='fintracker'):
+        self.run_name = run_name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.spans = {}
+            self.requests = {}
+            self.counters = {}
+            self.peaks = {}
+
+    @contextmanager
+    def span(self, name):
+        start = time.time()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.record_span(name, time.time() - start, failed)
+
+    def record_span(self, name, seconds, failed=False):
+        with self.lock:
+            span = self.spans.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+            span['calls'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+            span['errors'] += int(failed)
+
+    def record_request(self, service, endpoint, status, nbytes, seconds):
+        key = (service, endpoint, str(status))
+        with self.lock:
+            request = self.requests.setdefault(key, {'count': 0, 'bytes': 0, 'seconds': 0.0})
+            request['count'] += 1
+            request['bytes'] += nbytes or 0
+            request['seconds'] += seconds
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_peak(self, name, value, **labels):
+        """Keeps the largest value sampled during the run, e.g. a browser's resident memory"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.peaks[key] = max(self.peaks.get(key, value), value)
+
+    def snapshot(self, **extra):
+        with self.lock:
+            record = {
+                'run': self.run_name,
+                'started_at': self.started_at,
+                'seconds': time.time() - self.started_at,
+                'spans': dict((name, dict(span)) for name, span in self.spans.items()),
+                'requests': [dict(request, service=key[0], endpoint=key[1], status=key[2])
+                             for key, request in sorted(self.requests.items())],
+                'counters': [{'name': key[0], 'labels': dict(key[1]), 'value': value}
+                             for key, value in sorted(self.counters.items())],
+                'peaks': [{'name': key[0], 'labels': dict(key[1]), 'value': value}
+                          for key, value in sorted(self.peaks.items())],
+            }
+        record.update(extra)
+        return record
+
+    def write_json_log(self, record, path=METRICS_LOG_PATH):
+        ensure_dir(os.path.dirname(path))
+        with open(path, 'a') as logfile:
+            logfile.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def write_prometheus(self, record, textfile_dir=None):
+        textfile_dir = textfile_dir or os.environ.get(TEXTFILE_DIR_ENV) or TEXTFILE_DIR
+        ensure_dir(textfile_dir)
+        path = os.path.join(textfile_dir, '%s.prom' % self.run_name)
+        write_atomic(path, prometheus_text(record))  # node_exporter must never see a half written file
+        return path
+
+    def export(self, ok=True, log_path=METRICS_LOG_PATH, textfile_dir=None):
+        """Writes the current run to the JSON log and the Prometheus textfile; never raises"""
+        record = self.snapshot(ok=ok, finished_at=time.time())
+        try:
+            self.write_json_log(record, log_path)
+            self.write_prometheus(record, textfile_dir)
+        except (IOError, OSError) as e:
+            print("Could not export metrics: %s" % e)
+        return record
+
+def ensure_dir(path):
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+
+def label_text(labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key, value in labels)
+
+PROMETHEUS_METRICS = [
+    ('fintracker_last_run_timestamp_seconds', 'When the last run finished'),
+    ('fintracker_last_run_success', '1 if the last run finished without error'),
+    ('fintracker_run_seconds', 'Wall-clock seconds of the last run'),
+    ('fintracker_stage_seconds', 'Seconds spent in each stage during the last run'),
+    ('fintracker_stage_max_seconds', 'Longest single call of each stage during the last run'),
+    ('fintracker_stage_calls', 'Calls of each stage during the last run'),
+    ('fintracker_stage_errors', 'Calls of each stage that raised during the last run'),
+    ('fintracker_requests', 'HTTP requests during the last run'),
+    ('fintracker_request_bytes', 'Response bytes received during the last run'),
+    ('fintracker_request_seconds', 'Seconds spent waiting on HTTP requests during the last run'),
+    ('fintracker_events', 'Retries, errors and other counted events during the last run'),
+    ('fintracker_peak', 'Largest sampled value of each quantity during the last run, e.g. browser RSS bytes'),
+]
+
+def prometheus_text(record):
+    """Renders a snapshot() record in the Prometheus text exposition format, all gauges"""
+    run = ('run', record['run'])
+    samples = dict((name, []) for name, _ in PROMETHEUS_METRICS)
+    samples['fintracker_last_run_timestamp_seconds'].append(([run], record.get('finished_at', time.time())))
+    samples['fintracker_last_run_success'].append(([run], int(bool(record.get('ok', True)))))
+    samples['fintracker_run_seconds'].append(([run], record['seconds']))
+    for stage, span in sorted(record['spans'].items()):
+        labels = [run, ('stage', stage)]
+        samples['fintracker_stage_seconds'].append((labels, span['seconds']))
+        samples['fintracker_stage_max_seconds'].append((labels, span['max_seconds']))
+        samples['fintracker_stage_calls'].append((labels, span['calls']))
+        samples['fintracker_stage_errors'].append((labels, span['errors']))
+    for request in record['requests']:
+        labels = [run, ('service', request['service']), ('endpoint', request['endpoint']), ('status', request['status'])]
+        samples['fintracker_requests'].append((labels, request['count']))
+        samples['fintracker_request_bytes'].append((labels, request['bytes']))
+        samples['fintracker_request_seconds'].append((labels, request['seconds']))
+    for counter in record['counters']:
+        labels = [run, ('event', counter['name'])] + sorted(counter['labels'].items())
+        samples['fintracker_events'].append((labels, counter['value']))
+    for peak in record.get('peaks', []):
+        labels = [run, ('quantity', peak['name'])] + sorted(peak['labels'].items())
+        samples['fintracker_peak'].append((labels, peak['value']))
+
+    lines = []
+    for name, help_text in PROMETHEUS_METRICS:
+        if not samples[name]:
+            continue
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in samples[name]:
+            lines.append('%s{%s} %s' % (name, label_text(labels), repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def set_run_name(name):
+    """Names this process's runs, e.g. after the profile in a batch worker, so their textfiles don't collide"""
+    metrics.run_name = name
@@ -0,0 +1,159 @@
+from __future__ import print_function
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .balancestore import BalanceStore, BALANCE_STORE_PATH
+from .metrics import metrics
+
+"""
+The Mint, Robinhood and Sheets stages don't depend on each other until the final sheet write,
+so they are run side by side on a thread pool. The Selenium login is by far the slowest stage,
+so the Robinhood login and the Sheets discovery/read happen while it is still going.
+
+The Mint, Google and Robinhood clients are imported inside the stages that use them, so a command
+that only needs one of them never loads the others.
+"""
+
+def timed(timings, stage, func, *args, **kwargs):
+    """Calls func, recording its duration in timings and as a metrics span"""
+    start = time.time()
+    try:
+        with metrics.span(stage):
+            return func(*args, **kwargs)
+    finally:
+        timings[stage] = time.time() - start
+
+def print_timings(timings):
+    print("Stage timings:")
+    for stage, seconds in sorted(timings.items(), key=lambda item: item[1]):
+        print("  %-16s %7.2fs" % (stage, seconds))
+
+def login_mint(email, password, browser_slots=None):
+    """browser_slots: optional semaphore held while Chrome may be running, to cap concurrent browsers"""
+    from .localmintapi import Mint
+    from .sessioncache import default_session_store
+    if browser_slots is None:
+        return Mint.create(email, password, session_store=default_session_store(), handoff=True)
+    with browser_slots:
+        return Mint.create(email, password, session_store=default_session_store(), handoff=True)
+
+def collect_mint_findata(mint, timings, account_types=None, on_account=None):
+    """Returns {"fiName: accountName": abs(value)}, filling account_types with each one's Mint accountType if given.
+
+    Refreshes the accounts and waits for each institution to finish rather than reading whatever
+    Mint had cached; on_account(fintype, value, refreshed) is called as each one comes in, so
+    callers can act on the quick banks while the slow ones are still refreshing.
+    """
+    from .localmintapi import MintAuthError, make_accounts_presentable
+    print("Refreshing mint accounts")
+    findata = {}
+    start = time.time()
+    try:
+        with metrics.span('mint_accounts'):
+            for dat in mint.iter_refreshed_accounts():
+                make_accounts_presentable([dat])
+                fintype = "%s: %s" % (dat['fiName'], dat['accountName'])
+                findata[fintype] = abs(dat['value'])
+                if account_types is not None:
+                    account_types[fintype] = dat.get('accountType')
+                if on_account is not None:
+                    on_account(fintype, findata[fintype], dat['refreshed'])
+    except MintAuthError:
+        raise
+    except Exception as e:
+        print("Refreshing accounts encountered exception: %s" % e)
+    finally:
+        timings['mint_accounts'] = time.time() - start
+    return findata
+
+def get_mint_findata(email, password, timings, browser_slots=None, account_types=None):
+    print("Creating mint object")
+    mint = timed(timings, 'mint_login', login_mint, email, password, browser_slots)
+    atexit.register(mint.close)  # Ensure everything is torn down.
+    findata = collect_mint_findata(mint, timings, account_types)
+    mint.close()
+    return findata
+
+def prepare_finances_sheet(master_sheet):
+    from .googleapi import SheetsWriter, get_sheets_service, get_finances_sheet_tail
+    writer = SheetsWriter(get_sheets_service(), master_sheet)
+    return writer, get_finances_sheet_tail(writer)
+
+def write_finances_sheet(writer, findata, tail, sheet_cols=None):
+    """Writes today's Finances row, returns whether there was a sheet to write it to"""
+    from .googleapi import write_finances_row
+    written = write_finances_row(writer, findata, tail, sheet_cols)
+    writer.flush()
+    return written
+
+def record_written_balances(findata, account_types, written, path=BALANCE_STORE_PATH):
+    """Records findata once it made it into the sheet. collect_mint_findata returns whatever accounts
+    came in before a Mint failure, and the sheet write is what refuses a snapshot missing any of them,
+    so recording only after it keeps partial snapshots out of the history (and out of push-sheet)."""
+    if written:
+        record_balances(findata, account_types, path)
+    else:
+        print("No Finances row written, not recording balance history")
+
+def record_balances(findata, account_types, path=BALANCE_STORE_PATH):
+    """Appends findata to the local balance history; a failure here never fails the run"""
+    try:
+        store = BalanceStore(path)
+        try:
+            store.record(findata, account_types)
+        finally:
+            store.close()
+    except Exception as e:
+        print("Could not record balance history: %s" % e)
+
+def get_robinhood_value(robinhood_user, robinhood_pass):
+    """Robinhood portfolio value, or None (left blank in the sheet) if Robinhood can't be reached"""
+    from requests.exceptions import RequestException
+    from .robinhoodapi import get_robinhood_portfolio_value, RobinhoodError
+    try:
+        return get_robinhood_portfolio_value(robinhood_user, robinhood_pass)
+    except (RobinhoodError, RequestException) as e:
+        print("Could not get the Robinhood portfolio value: %s" % e)
+        return None
+
+def run_finances_pipeline(email, password, robinhood_user, robinhood_pass, master_sheet,
+                          sheet_cols=None, browser_slots=None, timings=None, balance_store_path=BALANCE_STORE_PATH):
+    """Runs one full snapshot and returns findata. Stage timings are added to `timings` if a dict is given,
+    and the run's metrics are exported when it finishes, whether or not it succeeded."""
+    if timings is None:
+        timings = {}
+    metrics.reset()
+    ok = False
+    try:
+        findata = snapshot_finances(email, password, robinhood_user, robinhood_pass, master_sheet,
+                                    sheet_cols, browser_slots, timings, balance_store_path)
+        ok = True
+        return findata
+    finally:
+        metrics.export(ok=ok)
+
+def snapshot_finances(email, password, robinhood_user, robinhood_pass, master_sheet,
+                      sheet_cols, browser_slots, timings, balance_store_path):
+    from .googleapi import print_findata_values
+    account_types = {u'Robinhood': 'investment'}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        mint_future = executor.submit(timed, timings, 'mint', get_mint_findata, email, password, timings, browser_slots,
+                                      account_types)
+        print("Retrieving robinhood portfolio")
+        robinhood_future = executor.submit(timed, timings, 'robinhood', get_robinhood_value, robinhood_user, robinhood_pass)
+        print("Reading finances sheet")
+        sheet_future = executor.submit(timed, timings, 'sheets_read', prepare_finances_sheet, master_sheet)
+
+        findata = mint_future.result()
+        findata[u'Robinhood'] = robinhood_future.result()
+        writer, tail = sheet_future.result()
+
+    print_findata_values(findata)
+    print("Updating finances sheet")
+    written = timed(timings, 'sheets_write', write_finances_sheet, writer, findata, tail, sheet_cols)
+    timed(timings, 'history', record_written_balances, findata, account_types, written, balance_store_path)
+    timings['total'] = time.time() - start
+    print_timings(timings)
+    return findata
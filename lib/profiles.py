@@ -0,0 +1,87 @@
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from . import ROOT_DIR, CACHE_DIR
+
+PROFILE_KEYS = ['name', 'mint_user', 'mint_pass', 'robinhood_user', 'robinhood_pass', 'sheet_id', 'sheet_cols']
+MAX_BROWSERS = 2
+
+"""
+Batch mode for tracking several households from one host. A profiles file is a JSON list like:
+
+    [{"name": "home", "mint_user": "...", "mint_pass": "...", "robinhood_user": "...", "robinhood_pass": "...",
+      "sheet_id": "...", "sheet_cols": ["Bank: Checking", ...], "creds_dir": "optional, defaults to creds/profiles/<name>"}]
+
+Every profile runs the normal pipeline in its own worker process (one process per profile, so the Google
+service registry and creds dir never leak between them), with its own creds dir, balances db and, if
+opted in, Chrome profile dir. The rest of cache/ (sheets state, discovery docs, session key) is shared,
+so those files are written atomically and locked where workers read-modify-write them. A semaphore shared
+by all workers caps how many Chrome instances run at once, and a failing profile is reported in the
+summary without affecting the others.
+"""
+
+_browser_slots = None
+
+def load_profiles(path):
+    with open(path) as profilesfile:
+        profiles = json.load(profilesfile)
+    for profile in profiles:
+        missing = [key for key in PROFILE_KEYS if key not in profile]
+        if missing:
+            raise ValueError('Profile %r is missing %s' % (profile.get('name'), ', '.join(missing)))
+        profile.setdefault('creds_dir', os.path.join(ROOT_DIR, 'creds', 'profiles', profile['name']))
+    return profiles
+
+def init_worker(browser_slots):
+    global _browser_slots
+    _browser_slots = browser_slots
+
+def run_profile(profile):
+    """Worker entry point, returns a summary dict and never raises"""
+    from . import getwebdriver
+    from .googleapi import set_creds_dir
+    from .metrics import set_run_name
+    from .pipeline import run_finances_pipeline
+
+    set_creds_dir(profile['creds_dir'])
+    set_run_name('profile_%s' % profile['name'])
+    if getwebdriver.BROWSER_PROFILE_DIR:  # opted in: one persistent Chrome profile per profile
+        getwebdriver.BROWSER_PROFILE_DIR = '%s-%s' % (getwebdriver.BROWSER_PROFILE_DIR, profile['name'])
+
+    timings = {}
+    summary = {'name': profile['name'], 'ok': False, 'error': None, 'timings': timings}
+    start = time.time()
+    try:
+        run_finances_pipeline(profile['mint_user'], profile['mint_pass'],
+                              profile['robinhood_user'], profile['robinhood_pass'], profile['sheet_id'],
+                              sheet_cols=profile['sheet_cols'], browser_slots=_browser_slots, timings=timings,
+                              balance_store_path=os.path.join(CACHE_DIR, 'balances-%s.db' % profile['name']))
+        summary['ok'] = True
+    except Exception as e:
+        traceback.print_exc()
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+    summary['seconds'] = time.time() - start
+    return summary
+
+def run_profiles(profiles, processes=None, max_browsers=MAX_BROWSERS):
+    """Runs every profile across a process pool and returns their summaries in profile order"""
+    browser_slots = multiprocessing.BoundedSemaphore(max_browsers)
+    pool = multiprocessing.Pool(processes=processes or len(profiles), initializer=init_worker,
+                                initargs=(browser_slots,), maxtasksperchild=1)
+    try:
+        return pool.map(run_profile, profiles, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def print_profile_summary(summaries):
+    print("Profile summary:")
+    for summary in summaries:
+        outcome = 'ok' if summary['ok'] else 'FAILED (%s)' % summary['error']
+        slowest = max(summary['timings'].items(), key=lambda item: item[1]) if summary['timings'] else None
+        print("  %-20s %7.2fs  %s%s" % (summary['name'], summary['seconds'], outcome,
+                                       ', slowest stage %s %.2fs' % slowest if slowest else ''))
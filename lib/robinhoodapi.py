@@ -1,13 +1,180 @@
-from Robinhood import Robinhood, exceptions
+from __future__ import print_function
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def get_robinhood_portfolio_value(username, password):
-	my_trader = Robinhood()
-	try:
-		my_trader.login(username=username, password=password)
-		portfolio = my_trader.portfolios()
-		if portfolio['extended_hours_equity']:
-			return float(portfolio['extended_hours_equity'])
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+from .sessioncache import default_session_store
+
+ROBINHOOD_API_ROOT = 'https://api.robinhood.com'
+ROBINHOOD_CLIENT_ID = 'c82SH0WZOsabOXGP2sxqcj34FxkvfnWRZBKlBjFS'  # the public web app's oauth client
+TOKEN_LIFETIME = 24 * 60 * 60  # seconds, what we ask for
+TOKEN_REFRESH_MARGIN = 5 * 60  # seconds, tokens closer than this to expiring are refreshed first
+REQUEST_TIMEOUT = 30  # seconds
+HTTP_POOL_SIZE = 4
+
+"""
+Talks to the Robinhood REST API directly over one keep-alive session. The oauth token and its refresh
+token are kept in the encrypted session cache, so a warm run is a single authenticated request for the
+portfolio instead of a password login every time:
+
+	client = get_robinhood_client(username, password)
+	client.portfolio_value()          # one GET /portfolios/ once a token is cached
+	client.snapshot()                 # portfolio, positions and account fetched concurrently
+
+Failures raise RobinhoodError subclasses rather than returning a sentinel value.
+"""
+
+class RobinhoodError(Exception):
+	pass
+
+class RobinhoodLoginError(RobinhoodError):
+	"""The username/password (or refresh token) was rejected"""
+	pass
+
+class RobinhoodMFARequired(RobinhoodLoginError):
+	pass
+
+class RobinhoodAuthError(RobinhoodError):
+	"""A request was rejected even after logging in again"""
+	pass
+
+def make_session(pool_size=HTTP_POOL_SIZE):
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	session.headers.update({'Accept': 'application/json', 'X-Robinhood-API-Version': '1.265.0'})
+	return session
+
+class RobinhoodClient(object):
+
+	def __init__(self, username, password, session_store=None, api_root=ROBINHOOD_API_ROOT):
+		self.username = username
+		self.password = password
+		self.session_store = session_store
+		self.api_root = api_root
+		self.session = make_session()
+		self.token = None
+		self.lock = threading.Lock()
+		if session_store:
+			self.token = session_store.load(self.session_name())
+
+	def session_name(self):
+		return 'robinhood:%s' % self.username
+
+	def token_is_fresh(self):
+		return bool(self.token) and self.token['expires_at'] - time.time() > TOKEN_REFRESH_MARGIN
+
+	def request_token(self, data):
+		data = dict(data, client_id=ROBINHOOD_CLIENT_ID, expires_in=TOKEN_LIFETIME, scope='internal')
+		result = self.timed_request('post', '/oauth2/token/', data=data)
+		try:
+			body = result.json()
+		except ValueError:
+			body = {}
+		if body.get('mfa_required'):
+			raise RobinhoodMFARequired('Robinhood requires an MFA code for %s' % self.username)
+		if result.status_code != requests.codes.ok or 'access_token' not in body:
+			raise RobinhoodLoginError('Robinhood login failed for %s, status = %d: %s' %
+					(self.username, result.status_code, body.get('detail') or body.get('error')))
+		self.token = {
+			'access_token': body['access_token'],
+			'refresh_token': body.get('refresh_token'),
+			'expires_at': time.time() + int(body.get('expires_in', TOKEN_LIFETIME)),
+		}
+		if self.session_store:
+			self.session_store.save(self.session_name(), self.token)
+
+	def login(self):
+		"""Makes sure there is a usable token: cached if fresh, else refreshed, else a password login"""
+		with self.lock:
+			if self.token_is_fresh():
+				return
+			if self.token and self.token.get('refresh_token'):
+				try:
+					self.request_token({'grant_type': 'refresh_token', 'refresh_token': self.token['refresh_token']})
+					return
+				except RobinhoodLoginError as e:
+					metrics.count('errors', service='robinhood', kind='token_refresh')
+					print("Robinhood token refresh failed (%s), logging in again" % e)
+			self.request_token({'grant_type': 'password', 'username': self.username, 'password': self.password})
+
+	def invalidate(self, access_token):
+		with self.lock:
+			if self.token and self.token['access_token'] == access_token:
+				self.token['expires_at'] = 0  # forces a refresh on the next login()
+
+	def get(self, path, **kwargs):
+		"""GETs an API path as JSON, logging in again and retrying once if the token is rejected"""
+		for attempt in range(2):
+			self.login()
+			access_token = self.token['access_token']
+			result = self.timed_request('get', path, headers={'Authorization': 'Bearer %s' % access_token}, **kwargs)
+			if result.status_code != 401:
+				break
+			metrics.count('retries', service='robinhood', kind='token_rejected')
+			self.invalidate(access_token)
 		else:
-			return float(portfolio['equity'])
-	except exceptions.LoginFailed: # This started happening even with valid creds due to robinhood update, expected token response
-		return "BADLOGIN"
+			metrics.count('errors', service='robinhood', kind='auth')
+			raise RobinhoodAuthError('Robinhood rejected the token requesting %s' % path)
+		if result.status_code != requests.codes.ok:
+			raise RobinhoodError('Error requesting %s, status = %d' % (path, result.status_code))
+		return result.json()
+
+	def timed_request(self, method, path, **kwargs):
+		start = time.time()
+		try:
+			result = self.session.request(method, self.api_root + path, timeout=REQUEST_TIMEOUT, **kwargs)
+		except requests.RequestException as e:
+			metrics.count('errors', service='robinhood', kind=type(e).__name__)
+			raise
+		metrics.record_request('robinhood', path, result.status_code, len(result.content), time.time() - start)
+		return result
+
+	def portfolio(self):
+		return first_result(self.get('/portfolios/'), 'portfolio')
+
+	def positions(self):
+		return self.get('/positions/', params={'nonzero': 'true'})['results']
+
+	def account(self):
+		return first_result(self.get('/accounts/'), 'account')
+
+	def snapshot(self):
+		"""Returns {'portfolio', 'positions', 'account'}, fetched side by side over the pooled session"""
+		self.login()  # once, before the requests race for it
+		with ThreadPoolExecutor(max_workers=3) as executor:
+			futures = dict((name, executor.submit(getattr(self, name))) for name in ('portfolio', 'positions', 'account'))
+		return dict((name, future.result()) for name, future in futures.items())
+
+	def portfolio_value(self, portfolio=None):
+		portfolio = portfolio or self.portfolio()
+		if portfolio.get('extended_hours_equity'):
+			return float(portfolio['extended_hours_equity'])
+		return float(portfolio['equity'])
+
+	def close(self):
+		self.session.close()
+
+def first_result(page, what):
+	if not page.get('results'):
+		raise RobinhoodError('Robinhood returned no %s' % what)
+	return page['results'][0]
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_robinhood_client(username, password):
+	"""One client per username for the life of the process, so long-running modes keep their session"""
+	with _clients_lock:
+		client = _clients.get(username)
+		if client is None or client.password != password:
+			client = _clients[username] = RobinhoodClient(username, password, session_store=default_session_store())
+		return client
+
+def get_robinhood_portfolio_value(username, password):
+	return get_robinhood_client(username, password).portfolio_value()
@@ -0,0 +1,104 @@
+from __future__ import print_function
+import errno
+import hashlib
+import json
+import os
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+from . import CACHE_DIR
+from .atomicfile import write_atomic
+
+SESSION_KEY_ENV = 'FINTRACKER_SESSION_KEY'
+SESSION_MAX_AGE = 7 * 24 * 60 * 60  # seconds, anything older is not worth probing
+
+def assert_fernet():
+    # Common function to check if cryptography is installed
+    if not Fernet:
+        raise ImportError(
+            'session caching requires cryptography; '
+            'please pip install cryptography'
+        )
+
+def load_or_create_key(key_path):
+    key = os.environ.get(SESSION_KEY_ENV)
+    if key:
+        return key.encode('ascii')
+    if os.path.exists(key_path):
+        with open(key_path, 'rb') as keyfile:
+            return keyfile.read().strip()
+
+    print("Creating session key at: %s" % key_path)
+    key = Fernet.generate_key()
+    tmp_path = '%s.%d.tmp' % (key_path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as keyfile:
+        keyfile.write(key)
+    try:
+        # link only succeeds if nobody else has created the key yet, and never exposes a half written one
+        os.link(tmp_path, key_path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        print("Another process created the session key first, using that one")
+        with open(key_path, 'rb') as keyfile:
+            key = keyfile.read().strip()
+    finally:
+        os.remove(tmp_path)
+    return key
+
+class SessionStore(object):
+    """Encrypted on-disk store for login sessions (cookies, tokens), one file per name.
+
+    The key is read from $FINTRACKER_SESSION_KEY, or from cache/session.key which is
+    created (mode 600) on first use.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_age=SESSION_MAX_AGE):
+        assert_fernet()
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.fernet = Fernet(load_or_create_key(os.path.join(cache_dir, 'session.key')))
+
+    def path_for(self, name):
+        digest = hashlib.sha256(name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '%s.session' % digest)
+
+    def load(self, name):
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as sessionfile:
+                saved = json.loads(self.fernet.decrypt(sessionfile.read()).decode('utf-8'))
+        except (InvalidToken, ValueError):
+            print("Discarding unreadable session file %s" % path)
+            self.clear(name)
+            return None
+        if time.time() - saved['saved_at'] > self.max_age:
+            self.clear(name)
+            return None
+        return saved['data']
+
+    def save(self, name, data):
+        path = self.path_for(name)
+        payload = json.dumps({'saved_at': time.time(), 'data': data}).encode('utf-8')
+        write_atomic(path, self.fernet.encrypt(payload), perms=0o600)
+
+    def clear(self, name):
+        path = self.path_for(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def default_session_store():
+    """Returns a SessionStore, or None (with a warning) when cryptography isn't installed"""
+    if not Fernet:
+        print("cryptography is not installed, sessions will not be cached between runs")
+        return None
+    return SessionStore()
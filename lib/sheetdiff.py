@@ -0,0 +1,78 @@
+import math
+
+"""
+Works out which cells of a block of rows differ from what was last written, so only those get sent.
+None cells are treated the way the Sheets values API treats them: leave whatever is there alone.
+"""
+
+def column_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def normalize(value):
+    if hasattr(value, 'item'):  # numpy scalars
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def changed_span(old_row, new_row):
+    """Returns (first, last) column indexes of new_row that differ from old_row, or None"""
+    old_row = old_row or []
+    first = last = None
+    for col, value in enumerate(new_row):
+        value = normalize(value)
+        if value is None:
+            continue
+        old_value = normalize(old_row[col]) if col < len(old_row) else None
+        if value != old_value:
+            if first is None:
+                first = col
+            last = col
+    return None if first is None else (first, last)
+
+def diff_rows(tab, start_row, old_rows, new_rows):
+    """Returns [(range_name, values)] covering every changed cell of new_rows, which start at sheet row start_row.
+
+    Consecutive changed rows are merged into one rectangular range spanning the union of their changed
+    columns; cells inside that range which didn't change are sent as None so they are left untouched.
+    """
+    ranges = []
+    block = None  # [first_row_offset, rows, first_col, last_col]
+    for offset, new_row in enumerate(new_rows):
+        old_row = old_rows[offset] if offset < len(old_rows) else None
+        span = changed_span(old_row, new_row)
+        if span is None:
+            if block:
+                ranges.append(block)
+                block = None
+            continue
+        if block:
+            block[1].append(offset)
+            block[2] = min(block[2], span[0])
+            block[3] = max(block[3], span[1])
+        else:
+            block = [offset, [offset], span[0], span[1]]
+    if block:
+        ranges.append(block)
+
+    result = []
+    for first_offset, offsets, first_col, last_col in ranges:
+        values = []
+        for offset in offsets:
+            old_row = old_rows[offset] if offset < len(old_rows) else None
+            row = []
+            for col in range(first_col, last_col + 1):
+                value = new_rows[offset][col] if col < len(new_rows[offset]) else None
+                old_value = old_row[col] if old_row and col < len(old_row) else None
+                row.append(None if normalize(value) == normalize(old_value) else normalize(value))
+            values.append(row)
+        range_name = '%s!%s%d:%s%d' % (tab, column_letter(first_col), start_row + first_offset,
+                                       column_letter(last_col), start_row + offsets[-1])
+        result.append((range_name, values))
+    return result
@@ -0,0 +1,99 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from . import CACHE_DIR
+
+DATE_FORMAT = '%Y-%m-%d'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    odate TEXT NOT NULL,
+    is_pending INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_odate ON transactions (odate);
+CREATE INDEX IF NOT EXISTS transactions_pending ON transactions (is_pending);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class TransactionStore(object):
+    """Local SQLite copy of the Mint JSON transactions, keyed by transaction id.
+
+    Each row keeps the raw JSON payload plus its parsed original date, and the
+    meta table keeps small JSON values between syncs (e.g. the ids of dropped
+    duplicates).
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, 'transactions.db')):
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, ids):
+        """Returns {id: (payload, odate)} for the ids that are stored"""
+        ids = list(ids)
+        stored = {}
+        # stay well under sqlite's bound parameter limit
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT id, payload, odate FROM transactions WHERE id IN (%s)' %
+                ','.join('?' * len(chunk)), chunk)
+            for txn_id, payload, odate in rows:
+                stored[txn_id] = (json.loads(payload), datetime.strptime(odate, DATE_FORMAT))
+        return stored
+
+    def between(self, start, end):
+        """Returns {id: (payload, odate)} for the transactions dated start to end, inclusive"""
+        rows = self.conn.execute(
+            'SELECT id, payload, odate FROM transactions WHERE odate BETWEEN ? AND ?',
+            (start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)))
+        return dict((txn_id, (json.loads(payload), datetime.strptime(odate, DATE_FORMAT)))
+                    for txn_id, payload, odate in rows)
+
+    def upsert(self, txns):
+        """Inserts or replaces (transaction, odate) pairs"""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO transactions (id, odate, is_pending, payload) VALUES (?, ?, ?, ?)',
+                [(t['id'], odate.strftime(DATE_FORMAT), int(bool(t.get('isPending'))), json.dumps(t))
+                 for t, odate in txns])
+
+    def delete(self, ids):
+        with self.conn:
+            self.conn.executemany('DELETE FROM transactions WHERE id = ?', [(i,) for i in ids])
+
+    def pending_ids(self):
+        return set(row[0] for row in self.conn.execute(
+            'SELECT id FROM transactions WHERE is_pending = 1'))
+
+    def oldest_pending_date(self):
+        odate = self.conn.execute(
+            'SELECT MIN(odate) FROM transactions WHERE is_pending = 1').fetchone()[0]
+        return datetime.strptime(odate, DATE_FORMAT) if odate else None
+
+    def transactions(self):
+        """Returns every stored transaction payload, newest first"""
+        return [json.loads(row[0]) for row in self.conn.execute(
+            'SELECT payload FROM transactions ORDER BY odate DESC, id DESC')]
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                              (key, json.dumps(value)))
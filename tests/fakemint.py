@@ -0,0 +1,38 @@
+import threading
+from datetime import datetime, timedelta
+
+from lib.localmintapi import Mint
+
+"""
+A Mint whose getJsonData.xevent pages come from an in-memory list of raw JSON transactions (newest
+first) instead of the network, recording every offset requested.
+"""
+
+def raw_transaction(txn_id, day, amount=5.0, merchant=None, pending=False):
+    """A raw JSON transaction dated `day` days before 2023-12-31, in the 'mm/dd/yy' form of past years"""
+    odate = (datetime(2023, 12, 31) - timedelta(days=day)).strftime('%m/%d/%y')
+    return {
+        'id': txn_id,
+        'date': odate,
+        'odate': odate,
+        'amount': '$%.2f' % amount,
+        'isDebit': True,
+        'account': 'Checking',
+        'merchant': merchant or 'Merchant %d' % txn_id,
+        'isPending': pending,
+        'isDuplicate': False,
+    }
+
+class PagedMint(Mint):
+
+    def __init__(self, transactions, page_size=5):
+        Mint.__init__(self)
+        self.transactions = transactions
+        self.page_size = page_size
+        self.offsets = []
+        self.lock = threading.Lock()
+
+    def get_transactions_page(self, offset, include_investment=False):
+        with self.lock:
+            self.offsets.append(offset)
+        return [dict(t) for t in self.transactions[offset:offset + self.page_size]]
@@ -0,0 +1,62 @@
+import socket
+
+import pytest
+
+from lib import daemon
+from lib.daemon import FintrackerDaemon, DaemonAlreadyRunning, send_control_command
+from lib.localmintapi import MintAuthError
+
+def make_daemon(control_socket):
+    return FintrackerDaemon('email', 'password', 'rh', 'rh', 'sheet', control_socket=control_socket)
+
+def test_second_daemon_leaves_a_live_socket_alone(tmpdir):
+    control_socket = str(tmpdir.join('fintracker.sock'))
+    server = make_daemon(control_socket).start_control_server()
+    try:
+        with pytest.raises(DaemonAlreadyRunning):
+            make_daemon(control_socket).start_control_server()
+        assert 'accounts' in send_control_command('status', control_socket)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_stale_socket_is_replaced(tmpdir):
+    control_socket = str(tmpdir.join('fintracker.sock'))
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(control_socket)
+    stale.close()
+    server = make_daemon(control_socket).start_control_server()
+    try:
+        assert 'accounts' in send_control_command('status', control_socket)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+class FakeMint(object):
+    def __init__(self, saved):
+        self.saved = saved
+        self.discarded = False
+
+    def discard_session(self):
+        self.discarded = True
+
+    def close(self):
+        if not self.discarded:
+            self.saved.append(self)
+
+def test_rejected_session_is_not_saved_on_relogin(monkeypatch):
+    saved, mints = [], []
+    def login_mint(email, password):
+        mints.append(FakeMint(saved))
+        return mints[-1]
+    monkeypatch.setattr(daemon, 'login_mint', login_mint)
+    fintracker = make_daemon(None)
+
+    def sync(mint):
+        if mint is mints[0]:
+            raise MintAuthError('session expired')
+        return 'synced'
+
+    assert fintracker.with_mint(sync) == 'synced'
+    assert len(mints) == 2
+    assert mints[0].discarded and saved == []
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from lib.dedupe import DuplicateIndex, duplicate_keys, find_duplicates
+from lib.localmintapi import JSON_DUPLICATE_COLUMNS
+
+def transactions(rows):
+    """rows of (id, date, account, amount, merchant)"""
+    return pd.DataFrame(rows, columns=['id', 'date', 'account', 'amount', 'merchant'])
+
+def keys(df):
+    return duplicate_keys(df, 'date', JSON_DUPLICATE_COLUMNS, ids=df['id'])
+
+def test_same_day_copy_is_marked():
+    df = transactions([
+        (1, '2024-01-02', 'Checking', 5.0, 'Coffee'),
+        (2, '2024-01-02', 'Checking', 5.0, 'Coffee'),
+        (3, '2024-01-02', 'Savings', 5.0, 'Coffee'),
+        (4, '2024-01-02', 'Checking', 6.0, 'Coffee'),
+    ])
+    assert DuplicateIndex(window_days=0).mark(keys(df)).tolist() == [False, True, False, False]
+
+def test_window_days():
+    df = transactions([
+        (1, '2024-01-02', 'Checking', 5.0, 'Coffee'),
+        (2, '2024-01-03', 'Checking', 5.0, 'Coffee'),
+        (3, '2024-01-06', 'Checking', 5.0, 'Coffee'),
+    ])
+    assert DuplicateIndex(window_days=0).mark(keys(df)).tolist() == [False, False, False]
+    assert DuplicateIndex(window_days=1).mark(keys(df)).tolist() == [False, True, False]
+
+def test_amount_and_text_are_normalized():
+    df = transactions([
+        (1, '2024-01-02', 'Checking', 4.99, 'Coffee'),
+        (2, '2024-01-02', 'checking', np.float32(4.99), ' COFFEE '),
+    ])
+    assert find_duplicates(df, 'date', JSON_DUPLICATE_COLUMNS, ids=df['id']).tolist() == [False, True]
+
+def test_batch_is_checked_against_added_transactions():
+    index = DuplicateIndex(window_days=1)
+    index.add(keys(transactions([(1, '2024-01-05', 'Checking', 20.0, 'Gas')])))
+    assert len(index) == 1
+    batch = transactions([
+        (1, '2024-01-05', 'Checking', 20.0, 'Gas'),  # the synced one seen again, not a copy
+        (2, '2024-01-04', 'Checking', 20.0, 'Gas'),  # a day before the synced one
+        (3, '2024-01-09', 'Checking', 20.0, 'Gas'),
+    ])
+    assert index.mark(keys(batch)).tolist() == [False, True, False]
+    assert len(index) == 2
+
+def test_later_batches_see_earlier_ones():
+    index = DuplicateIndex(window_days=0)
+    first = transactions([(1, '2024-01-02', 'Checking', 5.0, 'Coffee')])
+    second = transactions([(2, '2024-01-02', 'Checking', 5.0, 'Coffee')])
+    assert index.mark(keys(first)).tolist() == [False]
+    assert index.mark(keys(second)).tolist() == [True]
+
+def test_empty_batch():
+    index = DuplicateIndex()
+    assert index.mark(keys(transactions([]))).tolist() == []
+    assert len(index) == 0
+
+def test_rows_without_ids():
+    df = pd.DataFrame({
+        'date': ['01/02/2024', '01/02/2024'],
+        'account_name': ['Checking', 'Checking'],
+        'amount': [5.0, 5.0],
+        'description': ['Coffee', 'Coffee'],
+    })
+    assert find_duplicates(df, 'date', ['account_name', 'amount', 'description']).tolist() == [False, True]
+
+def test_only_kept_transactions_start_a_window():
+    df = transactions([(i, '2024-01-%02d' % (i + 1), 'Checking', 5.0, 'Coffee') for i in range(3)])
+    assert DuplicateIndex(window_days=1).mark(keys(df)).tolist() == [False, True, False]
+    month = transactions([(i, str(pd.Timestamp('2024-01-01') + pd.Timedelta(days=i))[:10], 'Checking', 5.0, 'Coffee')
+                          for i in range(30)])
+    assert DuplicateIndex(window_days=1).mark(keys(month)).sum() == 15
+
+def brute_force_duplicates(kept, batch, window_days):
+    """Marks batch rows in (day, batch order) order against every kept (hash, day) pair"""
+    kept = list(kept)
+    marked = [False] * len(batch)
+    for position in sorted(range(len(batch)), key=lambda i: (batch[i][1], i)):
+        hash_, day = batch[position]
+        if any(h == hash_ and abs(d - day) <= window_days for h, d in kept):
+            marked[position] = True
+        else:
+            kept.append((hash_, day))
+    return marked
+
+def test_matches_brute_force():
+    rng = np.random.RandomState(0)
+    for case in range(200):
+        window_days = rng.randint(0, 4)
+        synced = rng.randint(0, 3)
+        rows = [(i, '2024-01-%02d' % rng.randint(1, 9), 'Checking', float(rng.randint(1, 3)), 'Coffee')
+                for i in range(synced + rng.randint(1, 6))]
+        index = DuplicateIndex(window_days)
+        index.add(keys(transactions(rows[:synced])))
+        batch = keys(transactions(rows[synced:]))
+        expected = brute_force_duplicates(zip(index.kept['hash'], index.kept['day']),
+                                          list(zip(batch['hash'], batch['day'])), window_days)
+        assert index.mark(batch).tolist() == expected, (window_days, rows, synced)
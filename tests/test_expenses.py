@@ -0,0 +1,81 @@
+from io import BytesIO
+
+import pandas as pd
+
+from lib.expenses import ExpenseMatrix
+from lib.localmintapi import read_transactions_csv
+
+HEADER = '"Date","Description","Original Description","Amount","Transaction Type","Category","Account Name","Labels","Notes"\n'
+
+def csv_transactions(rows, notes=''):
+    """rows of (date, description, amount, transaction_type, category), parsed like a Mint download.
+    The original description is the first word of the description, which the user may have edited."""
+    lines = [HEADER] + ['"%s","%s","%s","%.2f","%s","%s","Checking","","%s"\n' % (
+        date, description, description.split()[0].upper(), amount, kind, category, notes)
+        for date, description, amount, kind, category in rows]
+    return read_transactions_csv(BytesIO(''.join(lines).encode('utf-8')))
+
+def json_transactions(rows):
+    """rows of (id, odate, amount, category), amounts already signed with spending positive"""
+    return pd.DataFrame(rows, columns=['id', 'odate', 'amount', 'category'])
+
+def cell(matrix, day, category):
+    return matrix.matrix.loc[pd.Timestamp(day), category]
+
+def test_identical_csv_transactions_both_count():
+    download = csv_transactions([
+        ('01/02/2024', 'Coffee Shop', 5.0, 'debit', 'Coffee Shops'),
+        ('01/02/2024', 'Coffee Shop', 5.0, 'debit', 'Coffee Shops'),
+    ])
+    matrix = ExpenseMatrix.from_transactions(download)
+    assert cell(matrix, '2024-01-02', 'coffee shops') == 10.0
+
+def test_merging_the_next_csv_download_does_not_double_count():
+    rows = [
+        ('01/02/2024', 'Coffee Shop', 5.0, 'debit', 'Coffee Shops'),
+        ('01/02/2024', 'Coffee Shop', 5.0, 'debit', 'Coffee Shops'),
+        ('01/03/2024', 'Paycheck', 1000.0, 'credit', 'Paycheck'),
+    ]
+    matrix = ExpenseMatrix.from_transactions(csv_transactions(rows))
+    touched = matrix.merge(csv_transactions(rows + [('01/05/2024', 'Grocer', 42.5, 'debit', 'Groceries')]))
+    assert cell(matrix, '2024-01-02', 'coffee shops') == 10.0
+    assert cell(matrix, '2024-01-03', 'paycheck') == -1000.0
+    assert cell(matrix, '2024-01-05', 'groceries') == 42.5
+    assert cell(matrix, '2024-01-04', 'groceries') == 0.0
+    assert pd.Timestamp('2024-01-05') in touched
+
+def test_edited_csv_transaction_replaces_its_old_row():
+    matrix = ExpenseMatrix.from_transactions(csv_transactions([
+        ('01/02/2024', 'Blue Bottle', 5.0, 'debit', 'Coffee Shops'),
+        ('01/02/2024', 'Blue Bottle', 5.0, 'debit', 'Coffee Shops'),
+    ]))
+    # one of the coffees recategorized and renamed in Mint, and a note added to every row
+    edited = csv_transactions([
+        ('01/02/2024', 'Blue Bottle Cafe', 5.0, 'debit', 'Restaurants'),
+        ('01/02/2024', 'Blue Bottle', 5.0, 'debit', 'Coffee Shops'),
+    ], notes='work')
+    touched = matrix.merge(edited)
+    assert list(touched) == [pd.Timestamp('2024-01-02')]
+    assert cell(matrix, '2024-01-02', 'coffee shops') == 5.0
+    assert cell(matrix, '2024-01-02', 'restaurants') == 5.0
+    assert len(matrix.spending) == 2
+
+def test_merge_replaces_by_id_and_recomputes_the_old_day():
+    matrix = ExpenseMatrix.from_transactions(json_transactions([
+        (1, '2024-01-02', 5.0, 'Coffee Shops'),
+        (2, '2024-01-02', 3.0, 'Coffee Shops'),
+        (3, '2024-01-04', 20.0, 'Gas & Fuel'),
+    ]))
+    touched = matrix.merge(json_transactions([(2, '2024-01-03', 3.5, 'Coffee Shops')]))
+    assert list(touched) == [pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-03')]
+    assert cell(matrix, '2024-01-02', 'coffee shops') == 5.0
+    assert cell(matrix, '2024-01-03', 'coffee shops') == 3.5
+    assert cell(matrix, '2024-01-04', 'gas & fuel') == 20.0
+
+def test_uncategorized_and_fixed_categories():
+    matrix = ExpenseMatrix.from_transactions(json_transactions([
+        (1, '2024-01-02', 5.0, None),
+        (2, '2024-01-02', 7.0, 'Groceries'),
+    ]), categories=['Groceries', 'Uncategorized', 'Rent'])
+    assert matrix.categories == ['groceries', 'uncategorized', 'rent']
+    assert list(matrix.rows()) == [['1/2/2024', 7.0, 5.0, 0.0]]
@@ -0,0 +1,41 @@
+import pytest
+
+from lib import pipeline
+from lib.balancestore import BalanceStore
+from lib.fakegoogle import FakeSheetsService
+from lib.googleapi import SheetsWriter
+
+SHEET_ID = 'test-sheet'
+SHEET_COLS = ['Bank: Account %d' % i for i in range(8)] + [u'Robinhood']
+
+@pytest.fixture
+def stages(tmpdir, monkeypatch):
+    """Runs snapshot_finances against a fake sheet, with the Mint and Robinhood stages stubbed out"""
+    sheets = FakeSheetsService()
+    sheets.tab(SHEET_ID, 'Finances').append(['1/1/2024'] + [1.0] * 17)
+    writer = SheetsWriter(sheets, SHEET_ID, str(tmpdir.join('state.json')), str(tmpdir.join('snapshot.json')))
+    stages = {'mint': dict((account, 100.0) for account in SHEET_COLS[:-1]), 'path': str(tmpdir.join('balances.db'))}
+    monkeypatch.setattr(pipeline, 'get_mint_findata', lambda *args: dict(stages['mint']))
+    monkeypatch.setattr(pipeline, 'get_robinhood_value', lambda *args: 1234.0)
+    monkeypatch.setattr(pipeline, 'prepare_finances_sheet', lambda master_sheet: (writer, (1, '1/1/2024')))
+    return stages
+
+def run(stages):
+    return pipeline.snapshot_finances('email', 'password', 'rh', 'rh', SHEET_ID, SHEET_COLS, None, {}, stages['path'])
+
+def latest(stages):
+    store = BalanceStore(stages['path'])
+    try:
+        return store.latest()[1]
+    finally:
+        store.close()
+
+def test_records_the_snapshot_it_wrote(stages):
+    run(stages)
+    assert latest(stages) == dict(stages['mint'], Robinhood=1234.0)
+
+def test_partial_mint_snapshot_is_not_recorded(stages):
+    stages['mint'] = {}  # collect_mint_findata's result when the refresh failed
+    with pytest.raises(KeyError):
+        run(stages)
+    assert not latest(stages)
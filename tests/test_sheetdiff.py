@@ -0,0 +1,40 @@
+import numpy as np
+
+from lib.sheetdiff import column_letter, diff_rows
+
+def test_column_letter():
+    assert [column_letter(i) for i in (0, 25, 26, 701, 702)] == ['A', 'Z', 'AA', 'ZZ', 'AAA']
+
+def test_unchanged_rows_send_nothing():
+    assert diff_rows('Finances', 2, [[1, 2, 3], [4, 5, 6]], [[1, 2, 3], [4, 5, 6]]) == []
+
+def test_single_changed_cell():
+    assert diff_rows('Finances', 2, [[1, 2, 3]], [[1, 5, 3]]) == [('Finances!B2:B2', [[5]])]
+
+def test_consecutive_rows_merge_into_one_range():
+    old_rows = [[1, 2, 3], [4, 5, 6]]
+    new_rows = [[9, 2, 3], [4, 5, 7]]
+    assert diff_rows('Finances', 10, old_rows, new_rows) == [
+        ('Finances!A10:C11', [[9, None, None], [None, None, 7]]),
+    ]
+
+def test_unchanged_row_splits_ranges():
+    assert diff_rows('Expenses', 2, [[1], [2], [3]], [[9], [2], [8]]) == [
+        ('Expenses!A2:A2', [[9]]),
+        ('Expenses!A4:A4', [[8]]),
+    ]
+
+def test_new_rows_are_sent_whole():
+    assert diff_rows('Expenses', 5, [['1/1/2024', 3.5]], [['1/1/2024', 3.5], ['1/2/2024', 4.0]]) == [
+        ('Expenses!A6:B6', [['1/2/2024', 4.0]]),
+    ]
+
+def test_none_cells_are_left_alone():
+    assert diff_rows('Finances', 2, [[1, 2]], [[None, 5]]) == [('Finances!B2:B2', [[5]])]
+    assert diff_rows('Finances', 2, [[1, 2]], [[None, None]]) == []
+
+def test_nan_and_numpy_scalars_compare_by_value():
+    assert diff_rows('Finances', 2, [[None, 2.0]], [[float('nan'), np.float64(2.0)]]) == []
+    ranges = diff_rows('Finances', 2, [[2.0]], [[np.float64(2.5)]])
+    assert ranges == [('Finances!A2:A2', [[2.5]])]
+    assert type(ranges[0][1][0][0]) is float
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from fakemint import PagedMint, raw_transaction
+
+def history(count):
+    return [raw_transaction(i, i) for i in range(count)]
+
+def test_pages_arrive_in_order():
+    transactions = history(23)
+    mint = PagedMint(transactions)
+    pages = list(mint.iter_transaction_pages())
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [t['id'] for page in pages for t in page] == [t['id'] for t in transactions]
+
+def test_requests_stop_near_the_end():
+    mint = PagedMint(history(23))
+    list(mint.iter_transaction_pages(in_flight=4))
+    # the first page alone, then at most in_flight pages requested ahead of the short last one
+    assert mint.offsets[0] == 0
+    assert sorted(mint.offsets) == list(range(0, 5 * len(mint.offsets), 5))
+    assert max(mint.offsets) <= 20 + 4 * 5
+
+def test_exact_multiple_of_the_page_size():
+    mint = PagedMint(history(10))
+    assert [len(page) for page in mint.iter_transaction_pages(in_flight=2)] == [5, 5]
+
+def test_empty_history():
+    mint = PagedMint([])
+    assert list(mint.iter_transaction_pages()) == []
+    assert mint.offsets == [0]
+
+def test_start_date_cuts_the_crossing_page():
+    transactions = history(23)
+    start_date = datetime(2023, 12, 31 - 7)  # ids 0 to 7 are on or after it
+    pages = list(PagedMint(transactions).iter_transaction_pages(start_date=start_date))
+    assert [[t['id'] for t in page] for page in pages] == [[0, 1, 2, 3, 4], [5, 6, 7]]
+
+def test_start_date_on_a_page_boundary():
+    start_date = datetime(2023, 12, 31 - 4)
+    pages = list(PagedMint(history(23)).iter_transaction_pages(start_date=start_date))
+    assert [[t['id'] for t in page] for page in pages] == [[0, 1, 2, 3, 4]]
+
+def test_serial_with_a_driver():
+    mint = PagedMint(history(12))
+    mint.driver = object()  # pages then can't be fetched from other threads
+    assert [len(page) for page in mint.iter_transaction_pages()] == [5, 5, 2]
+    assert mint.offsets == [0, 5, 10]
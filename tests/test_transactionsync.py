@@ -0,0 +1,64 @@
+from lib.transactionstore import TransactionStore
+
+from fakemint import PagedMint, raw_transaction
+
+def history(count, first_id=1, first_day=0):
+    """count transactions on consecutive days, newest first"""
+    return [raw_transaction(first_id + i, first_day + i) for i in range(count)]
+
+def make_store(tmpdir):
+    return TransactionStore(str(tmpdir.join('transactions.db')))
+
+def ids(txns):
+    return [t['id'] for t in txns]
+
+def test_first_sync_stores_everything(tmpdir):
+    store = make_store(tmpdir)
+    mint = PagedMint(history(12))
+    assert ids(mint.sync_transactions(store)) == list(range(1, 13))
+    assert ids(store.transactions()) == list(range(1, 13))
+    assert mint.offsets == [0, 5, 10, 12]
+
+def test_unchanged_sync_stops_after_the_first_page(tmpdir):
+    store = make_store(tmpdir)
+    PagedMint(history(12)).sync_transactions(store)
+    mint = PagedMint(history(12))
+    assert mint.sync_transactions(store) == []
+    assert mint.offsets == [0]
+
+def test_new_and_edited_transactions_are_returned(tmpdir):
+    store = make_store(tmpdir)
+    PagedMint(history(12, first_id=10, first_day=3)).sync_transactions(store)
+    transactions = history(3) + history(12, first_id=10, first_day=3)
+    transactions[4]['merchant'] = 'Renamed'  # id 11
+    mint = PagedMint(transactions)
+    assert ids(mint.sync_transactions(store)) == [1, 2, 3, 11]
+    assert mint.offsets == [0, 5]  # the second page is all stored and unchanged
+    assert len(store.transactions()) == 15
+
+def test_posted_pending_transactions_are_removed(tmpdir):
+    store = make_store(tmpdir)
+    transactions = history(12)
+    transactions[9]['isPending'] = True  # id 10, on the second page
+    PagedMint(transactions).sync_transactions(store)
+
+    posted = history(12)
+    del posted[9]
+    posted.insert(0, raw_transaction(100, 0))  # posted under a new id
+    mint = PagedMint(posted)
+    assert ids(mint.sync_transactions(store)) == [100]
+    assert mint.offsets == [0, 5, 10]  # kept paging until past the oldest pending one
+    assert 10 not in ids(store.transactions())
+    assert store.pending_ids() == set()
+
+def test_skipped_duplicates_stay_skipped(tmpdir):
+    store = make_store(tmpdir)
+    transactions = history(6)
+    transactions.insert(3, raw_transaction(50, 2, merchant='Merchant 3'))  # a copy of id 3
+    mint = PagedMint(transactions)
+    assert 50 not in ids(mint.sync_transactions(store, skip_duplicates=True))
+    assert store.get_meta('duplicate_ids') == [50]
+
+    mint = PagedMint(transactions)
+    assert mint.sync_transactions(store, skip_duplicates=True) == []
+    assert 50 not in ids(store.transactions())
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from lib.fakegoogle import FakeGmailService
+from lib.googleapi import wait_for_mint_verification_code, VerificationCodeTimeout, VERIFICATION_CLOCK_SKEW
+
+def wait(gmail, since, **kwargs):
+    kwargs.setdefault('timeout', 2)
+    return wait_for_mint_verification_code(since, initial_delay=0.01, max_delay=0.05, service=gmail, **kwargs)
+
+def test_returns_code_already_in_inbox():
+    gmail = FakeGmailService()
+    since = time.time()
+    gmail.deliver('Your Mint code is: 123456 It expires in 10 minutes')
+    assert wait(gmail, since) == '123456'
+
+def test_waits_for_code_that_arrives_later():
+    gmail = FakeGmailService()
+    since = time.time()
+    gmail.deliver('Your Mint code is: 654321 It expires in 10 minutes', delay=0.2)
+    assert wait(gmail, since) == '654321'
+    assert len([call for call in gmail.calls if call[0] == 'list']) > 1
+
+def test_ignores_code_from_an_earlier_login():
+    gmail = FakeGmailService()
+    since = time.time()
+    gmail.deliver('Your Mint code is: 111111 It expires in 10 minutes', at=since - VERIFICATION_CLOCK_SKEW - 60)
+    gmail.deliver('Your Mint code is: 222222 It expires in 10 minutes', delay=0.1)
+    assert wait(gmail, since) == '222222'
+
+def test_skips_rejected_code_and_waits_for_a_newer_one():
+    gmail = FakeGmailService()
+    since = time.time()
+    gmail.deliver('Your Mint code is: 333333 It expires in 10 minutes')
+    gmail.deliver('Your Mint code is: 444444 It expires in 10 minutes', delay=0.2)
+    assert wait(gmail, since, skip_codes=('333333',)) == '444444'
+
+def test_ignores_other_subjects():
+    gmail = FakeGmailService()
+    since = time.time()
+    gmail.deliver('Your Mint code is: 555555 It expires in 10 minutes', subject='Your monthly summary')
+    with pytest.raises(VerificationCodeTimeout):
+        wait(gmail, since, timeout=0.2)
+
+def test_times_out_without_a_code():
+    gmail = FakeGmailService()
+    start = time.time()
+    with pytest.raises(VerificationCodeTimeout):
+        wait(gmail, start, timeout=0.2)
+    assert time.time() - start < 1